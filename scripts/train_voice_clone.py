@@ -12,28 +12,152 @@ from pathlib import Path
 from typing import List, Dict, Any, Optional
 import subprocess
 import logging
+import queue
+import runpy
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 # Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('voice_training.log'),
-        logging.StreamHandler()
-    ]
-)
+if sys.argv[1:2] == ["--train-worker"]:
+    # Вывод воркера обучения пишет в лог родительский процесс (run_command):
+    # здесь только текст сообщения, без второго файла лога в cwd воркера
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+else:
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler('voice_training.log'),
+            logging.StreamHandler()
+        ]
+    )
 logger = logging.getLogger(__name__)
 
+# Количество файлов, конвертируемых одним процессом ffmpeg
+FFMPEG_BATCH_SIZE = 16
+
+class AsyncCheckpointSaver:
+    """Фоновая запись чекпоинтов, чтобы обучение не ждало диск"""
+    
+    def __init__(self, max_pending: int = 2, manifest_file: Optional[Path] = None):
+        self.manifest_file = manifest_file
+        # Ограничиваем очередь, чтобы не держать в памяти много копий модели
+        self.queue: "queue.Queue" = queue.Queue(maxsize=max_pending)
+        self.thread = threading.Thread(target=self._worker, name="checkpoint-saver", daemon=True)
+        self.thread.start()
+    
+    @staticmethod
+    def _to_cpu(obj: Any) -> Any:
+        """Копирование тензоров состояния на CPU"""
+        import torch
+        
+        if isinstance(obj, torch.Tensor):
+            if obj.device.type == "cpu":
+                # Тензор уже на CPU: копируем, иначе оптимизатор изменит его во время записи
+                return obj.detach().clone()
+            return obj.detach().to("cpu", non_blocking=True)
+        if isinstance(obj, dict):
+            return {k: AsyncCheckpointSaver._to_cpu(v) for k, v in obj.items()}
+        if isinstance(obj, (list, tuple)):
+            return type(obj)(AsyncCheckpointSaver._to_cpu(v) for v in obj)
+        return obj
+    
+    def save(self, state: Dict[str, Any], path: Any, **kwargs) -> None:
+        """Постановка чекпоинта в очередь на запись"""
+        import torch
+        
+        cpu_state = self._to_cpu(state)
+        event = None
+        if torch.cuda.is_available():
+            # Копирование идет асинхронно, запись дождется его завершения
+            event = torch.cuda.Event()
+            event.record()
+        # save_best_model сразу копирует и ищет файл лучшей модели,
+        # поэтому ее запись дожидаемся синхронно
+        done = threading.Event() if "best_model" in os.path.basename(str(path)) else None
+        self.queue.put((cpu_state, str(path), event, done))
+        if done is not None:
+            done.wait()
+    
+    def _worker(self) -> None:
+        import torch
+        
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                state, path, event, done = item
+                try:
+                    if event is not None:
+                        event.synchronize()
+                    torch.save(state, path)
+                    self._record(path)
+                    logger.info(f"Чекпоинт сохранен: {path}")
+                finally:
+                    if done is not None:
+                        done.set()
+            except Exception as e:
+                logger.error(f"Ошибка сохранения чекпоинта: {e}")
+            finally:
+                self.queue.task_done()
+    
+    def _record(self, path: str) -> None:
+        """Добавление чекпоинта в манифест"""
+        if self.manifest_file is None or not path.endswith(".pth"):
+            return
+        
+        checkpoints = []
+        if self.manifest_file.exists():
+            with open(self.manifest_file, 'r') as f:
+                checkpoints = json.load(f)
+        checkpoints = [c for c in checkpoints if c["path"] != path]
+        checkpoints.append({"path": path, "mtime": os.stat(path).st_mtime})
+        
+        with open(self.manifest_file, 'w') as f:
+            json.dump(checkpoints, f, indent=2)
+    
+    def close(self) -> None:
+        """Ожидание записи всех чекпоинтов"""
+        self.queue.put(None)
+        self.thread.join()
+
+
+def run_training_worker(train_script: str, args: List[str],
+                        manifest_file: Optional[Path] = None) -> None:
+    """Запуск скрипта обучения Coqui TTS с асинхронной записью чекпоинтов"""
+    saver = AsyncCheckpointSaver(manifest_file=manifest_file)
+    
+    # Coqui сохраняет чекпоинты через save_fsspec (trainer.io / TTS.utils.io)
+    for module_name in ("trainer.io", "TTS.utils.io"):
+        try:
+            module = __import__(module_name, fromlist=["save_fsspec"])
+        except ImportError:
+            continue
+        if hasattr(module, "save_fsspec"):
+            module.save_fsspec = saver.save
+            logger.info(f"Асинхронная запись чекпоинтов включена ({module_name})")
+    
+    sys.argv = [train_script] + args
+    try:
+        runpy.run_path(train_script, run_name="__main__")
+    finally:
+        saver.close()
+
 class VoiceCloner:
     """Класс для клонирования голоса с помощью Coqui TTS"""
     
     def __init__(self):
-        self.project_root = Path.cwd()
+        self.project_root = Path.cwd().resolve()
         self.audio_dir = self.project_root / "uploads" / "audio"
         self.models_dir = self.project_root / "models"
         self.coqui_dir = self.models_dir / "coqui_tts"
         self.training_dir = self.project_root / "training"
         self.output_dir = self.project_root / "models" / "voice_clone"
+        self.prepared_dir = self.training_dir / "prepared_audio"
+        self.wav_manifest_file = self.training_dir / "audio_manifest.json"
+        self.checkpoints_file = self.output_dir / "checkpoints.json"
+        self._wav_manifest: Optional[List[Dict[str, Any]]] = None
         
         # Создаем необходимые директории
         self.training_dir.mkdir(exist_ok=True)
@@ -64,21 +188,83 @@ class VoiceCloner:
         print(f"\n📋 {step}")
         print("-" * 40)
     
+    def write_wav_manifest(self) -> List[Dict[str, Any]]:
+        """Сканирование подготовленных WAV файлов и запись манифеста"""
+        manifest = []
+        if self.prepared_dir.exists():
+            with os.scandir(self.prepared_dir) as entries:
+                for entry in entries:
+                    if entry.is_file() and entry.name.endswith(".wav"):
+                        manifest.append({
+                            "path": entry.path,
+                            "stem": entry.name[:-len(".wav")],
+                            "size": entry.stat().st_size,
+                            "mtime": entry.stat().st_mtime
+                        })
+        manifest.sort(key=lambda item: item["path"])
+        
+        with open(self.wav_manifest_file, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2, ensure_ascii=False)
+        
+        self._wav_manifest = manifest
+        return manifest
+    
+    def get_wav_manifest(self) -> List[Dict[str, Any]]:
+        """Манифест подготовленных WAV файлов (читается один раз)"""
+        if self._wav_manifest is None:
+            if self.wav_manifest_file.exists():
+                with open(self.wav_manifest_file, 'r', encoding='utf-8') as f:
+                    self._wav_manifest = json.load(f)
+            else:
+                self.write_wav_manifest()
+        return self._wav_manifest
+    
+    def find_latest_checkpoint(self) -> Optional[Path]:
+        """Поиск последнего чекпоинта по манифесту"""
+        checkpoints = []
+        if self.checkpoints_file.exists():
+            with open(self.checkpoints_file, 'r') as f:
+                checkpoints = [c for c in json.load(f) if os.path.exists(c["path"])]
+        
+        if not checkpoints:
+            # Манифеста нет (например, модель обучена вручную) — один проход по папке
+            with os.scandir(self.output_dir) as entries:
+                checkpoints = [
+                    {"path": entry.path, "mtime": entry.stat().st_mtime}
+                    for entry in entries
+                    if entry.is_file() and entry.name.endswith(".pth")
+                ]
+        
+        if not checkpoints:
+            return None
+        return Path(max(checkpoints, key=lambda c: c["mtime"])["path"])
+    
     def run_command(self, command: List[str], cwd: Optional[Path] = None) -> bool:
         """Выполнение команды"""
         try:
-            result = subprocess.run(
-                command, 
-                capture_output=True, 
-                text=True, 
-                cwd=cwd,
-                check=True
+            # Вывод читается построчно, чтобы не копить логи долгих процессов в памяти
+            process = subprocess.Popen(
+                command,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                text=True,
+                bufsize=-1,
+                cwd=cwd
             )
+        except OSError as e:
+            logger.error(f"Ошибка запуска команды: {e}")
+            return False
+        
+        with process.stdout:
+            for line in process.stdout:
+                logger.info(line.rstrip())
+        
+        if process.wait() == 0:
             logger.info(f"Команда выполнена успешно: {' '.join(command)}")
             return True
-        except subprocess.CalledProcessError as e:
-            logger.error(f"Ошибка выполнения команды: {e.stderr}")
-            return False
+        
+        logger.error(f"Ошибка выполнения команды (код {process.returncode}): {' '.join(command)}")
+        return False
     
     def prepare_audio_data(self) -> bool:
         """Подготовка аудиоданных для обучения"""
@@ -89,44 +275,70 @@ class VoiceCloner:
             return False
         
         # Создаем папку для подготовленных данных
-        prepared_dir = self.training_dir / "prepared_audio"
+        prepared_dir = self.prepared_dir
         prepared_dir.mkdir(exist_ok=True)
         
         # Конвертируем OGG в WAV и нормализуем
         audio_files = list(self.audio_dir.glob("*.ogg"))
         logger.info(f"Найдено {len(audio_files)} аудиофайлов")
         
+        # Один процесс ffmpeg обрабатывает пачку файлов, пачки идут параллельно
+        batches = [
+            audio_files[i:i + FFMPEG_BATCH_SIZE]
+            for i in range(0, len(audio_files), FFMPEG_BATCH_SIZE)
+        ]
+        max_workers = max(1, (os.cpu_count() or 2) // 2)
+        
         converted_count = 0
-        for audio_file in audio_files:
-            output_file = prepared_dir / f"{audio_file.stem}.wav"
-            
-            # Конвертируем в WAV с нужными параметрами
-            success = self.run_command([
-                "ffmpeg", "-i", str(audio_file),
-                "-ar", str(self.training_config["sample_rate"]),
-                "-ac", "1",  # моно
-                "-f", "wav",
-                str(output_file)
-            ])
-            
-            if success:
-                converted_count += 1
-                logger.info(f"Конвертирован: {audio_file.name}")
-            else:
-                logger.warning(f"Ошибка конвертации: {audio_file.name}")
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for converted in executor.map(lambda batch: self._convert_batch(batch, prepared_dir), batches):
+                converted_count += converted
         
         logger.info(f"Конвертировано {converted_count}/{len(audio_files)} файлов")
+        
+        manifest = self.write_wav_manifest()
+        logger.info(f"Манифест аудио сохранен: {self.wav_manifest_file} ({len(manifest)} файлов)")
         return converted_count > 0
     
+    def _ffmpeg_outputs(self, audio_file: Path, index: int, prepared_dir: Path) -> List[str]:
+        """Параметры вывода ffmpeg для одного входного файла"""
+        return [
+            "-map", f"{index}:a",
+            "-ar", str(self.training_config["sample_rate"]),
+            "-ac", "1",  # моно
+            "-f", "wav",
+            str(prepared_dir / f"{audio_file.stem}.wav")
+        ]
+    
+    def _convert_batch(self, batch: List[Path], prepared_dir: Path) -> int:
+        """Конвертация пачки файлов одним вызовом ffmpeg"""
+        command = ["ffmpeg", "-y"]
+        for audio_file in batch:
+            command += ["-i", str(audio_file)]
+        for index, audio_file in enumerate(batch):
+            command += self._ffmpeg_outputs(audio_file, index, prepared_dir)
+        
+        if self.run_command(command):
+            for audio_file in batch:
+                logger.info(f"Конвертирован: {audio_file.name}")
+            return len(batch)
+        
+        if len(batch) == 1:
+            logger.warning(f"Ошибка конвертации: {batch[0].name}")
+            return 0
+        
+        # Один битый файл роняет всю пачку — повторяем по одному
+        logger.warning("Ошибка пакетной конвертации, повтор по одному файлу")
+        return sum(self._convert_batch([audio_file], prepared_dir) for audio_file in batch)
+    
     def create_metadata(self) -> bool:
         """Создание метаданных для обучения"""
         self.print_step("Создание метаданных")
         
-        prepared_dir = self.training_dir / "prepared_audio"
         metadata_file = self.training_dir / "metadata.csv"
         
         # Получаем список WAV файлов
-        wav_files = list(prepared_dir.glob("*.wav"))
+        wav_files = [Path(item["path"]) for item in self.get_wav_manifest()]
         
         if not wav_files:
             logger.error("Не найдены WAV файлы для обучения")
@@ -181,7 +393,7 @@ class VoiceCloner:
             
             "paths": {
                 "output_path": str(self.output_dir),
-                "data_path": str(self.training_dir / "prepared_audio"),
+                "data_path": str(self.prepared_dir),
                 "meta_file_train": str(self.training_dir / "metadata.csv")
             }
         }
@@ -201,23 +413,20 @@ class VoiceCloner:
             logger.error("Coqui TTS не установлен")
             return False
         
-        # Переходим в папку Coqui TTS
-        os.chdir(self.coqui_dir)
-        
         # Запускаем обучение
         training_command = [
-            sys.executable, "TTS/bin/train_tts.py",
+            sys.executable, str(Path(__file__).resolve()),
+            "--train-worker", str(self.checkpoints_file),
+            str(self.coqui_dir / "TTS" / "bin" / "train_tts.py"),
             "--config_path", str(self.training_dir / "config.json")
         ]
         
         logger.info("Запуск обучения...")
         logger.info(f"Команда: {' '.join(training_command)}")
         
+        # Рабочая папка передается процессу, текущая папка скрипта не меняется
         success = self.run_command(training_command, cwd=self.coqui_dir)
         
-        # Возвращаемся в корневую папку
-        os.chdir(self.project_root)
-        
         if success:
             logger.info("✅ Обучение завершено успешно")
             return True
@@ -229,64 +438,46 @@ class VoiceCloner:
         """Тестирование клонированного голоса"""
         self.print_step("Тестирование клонированного голоса")
         
-        # Находим лучшую модель
-        model_files = list(self.output_dir.glob("*.pth"))
-        if not model_files:
+        # Берем последнюю модель
+        best_model = self.find_latest_checkpoint()
+        if best_model is None:
             logger.error("Модели не найдены")
             return False
         
-        # Берем последнюю модель
-        best_model = max(model_files, key=lambda x: x.stat().st_mtime)
         logger.info(f"Используем модель: {best_model}")
         
-        # Создаем тестовый скрипт
-        test_script = self.training_dir / "test_voice.py"
+        # Синтезируем тестовую фразу в текущем процессе
+        if str(self.coqui_dir) not in sys.path:
+            sys.path.append(str(self.coqui_dir))
         
-        test_code = f'''
-import sys
-import os
-sys.path.append("{self.coqui_dir}")
-
-from TTS.api import TTS
-
-# Загружаем модель
-tts = TTS(model_path="{best_model}")
-
-# Тестовый текст
-text = "Привет! Я цифровой аватар. Как дела?"
-
-# Генерируем речь
-output_path = "{self.output_dir}/test_output.wav"
-tts.tts_to_file(text=text, file_path=output_path, speaker="{self.training_config['speaker_name']}")
-
-print(f"Тестовый аудио сохранен: {{output_path}}")
-'''
-        
-        with open(test_script, 'w') as f:
-            f.write(test_code)
-        
-        # Запускаем тест
-        success = self.run_command([
-            sys.executable, str(test_script)
-        ])
+        try:
+            from TTS.api import TTS
+        except ImportError:
+            logger.error("Coqui TTS не установлен")
+            return False
         
-        if success:
-            logger.info("✅ Тест голоса выполнен успешно")
-            return True
-        else:
-            logger.error("❌ Ошибка тестирования")
+        output_path = self.output_dir / "test_output.wav"
+        try:
+            tts = TTS(model_path=str(best_model))
+            tts.tts_to_file(
+                text="Привет! Я цифровой аватар. Как дела?",
+                file_path=str(output_path),
+                speaker=self.training_config["speaker_name"]
+            )
+        except Exception as e:
+            logger.error(f"❌ Ошибка тестирования: {e}")
             return False
+        
+        logger.info(f"Тестовый аудио сохранен: {output_path}")
+        logger.info("✅ Тест голоса выполнен успешно")
+        return True
     
     def create_voice_config(self) -> bool:
         """Создание конфигурации голоса"""
         self.print_step("Создание конфигурации голоса")
         
         # Находим лучшую модель
-        model_files = list(self.output_dir.glob("*.pth"))
-        if model_files:
-            best_model = max(model_files, key=lambda x: x.stat().st_mtime)
-        else:
-            best_model = None
+        best_model = self.find_latest_checkpoint()
         
         voice_config = {
             "voice_clone": {
@@ -299,7 +490,7 @@ print(f"Тестовый аудио сохранен: {{output_path}}")
                     "epochs": self.training_config["epochs"],
                     "batch_size": self.training_config["batch_size"],
                     "learning_rate": self.training_config["learning_rate"],
-                    "audio_files_used": len(list((self.training_dir / "prepared_audio").glob("*.wav")))
+                    "audio_files_used": len(self.get_wav_manifest())
                 }
             }
         }
@@ -356,7 +547,8 @@ print(f"Тестовый аудио сохранен: {{output_path}}")
             print("⚠️  Некоторые этапы не выполнены")
         
         # Сохраняем отчет
-        with open("voice_cloning_report.json", "w") as f:
+        report_file = self.project_root / "voice_cloning_report.json"
+        with open(report_file, "w") as f:
             json.dump({
                 "results": results,
                 "training_config": self.training_config,
@@ -365,10 +557,14 @@ print(f"Тестовый аудио сохранен: {{output_path}}")
                 "successful_steps": success_count
             }, f, indent=2)
         
-        print(f"\n💾 Отчет сохранен в voice_cloning_report.json")
+        print(f"\n💾 Отчет сохранен в {report_file}")
 
 def main():
     """Основная функция"""
+    if len(sys.argv) > 3 and sys.argv[1] == "--train-worker":
+        run_training_worker(sys.argv[3], sys.argv[4:], Path(sys.argv[2]))
+        return
+    
     cloner = VoiceCloner()
     cloner.run_voice_cloning()
 
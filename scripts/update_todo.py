@@ -49,31 +49,82 @@ def find_todo_sections(content: str) -> Tuple[str, str, str]:
     
     return completed_section, in_progress_section, todo_section
 
+def _find_section(lines: List[str], header_prefix: str) -> Optional[Tuple[int, int]]:
+    """Поиск границ секции: индекс заголовка и индекс следующего заголовка."""
+    start = None
+    for i, line in enumerate(lines):
+        if line.startswith('## '):
+            if start is not None:
+                return start, i
+            if line.startswith(header_prefix):
+                start = i
+    
+    if start is not None:
+        return start, len(lines)
+    return None
+
+def _insert_into_section(lines: List[str], header_prefix: str, new_line: str) -> bool:
+    """Добавить строку в конец секции (перед пустыми строками и разделителем)."""
+    bounds = _find_section(lines, header_prefix)
+    if bounds is None:
+        return False
+    
+    start, end = bounds
+    insert_at = end
+    while insert_at - 1 > start and lines[insert_at - 1].strip() in ('', '---'):
+        insert_at -= 1
+    
+    lines.insert(insert_at, new_line + '\n')
+    return True
+
+COMPLETED_HEADER = '## ✅ Выполнено'
+TODO_HEADER = '## 📋 Предстоит выполнить'
+
+def _match_task(line: str, task_name: str) -> Optional[str]:
+    """Суффикс строки открытой задачи task_name (например, ' (🔥 Высокий)') или None."""
+    stripped = line.strip()
+    target = f'- [ ] {task_name}'
+    if stripped == target:
+        return ''
+    # Допускается только пометка в скобках после названия задачи
+    if stripped.startswith(target + ' ('):
+        return stripped[len(target):]
+    return None
+
 def mark_task_completed(content: str, task_name: str) -> str:
     """Отметить задачу как выполненную."""
-    # Ищем задачу в секции "Предстоит выполнить"
-    pattern = rf'(\s*)- \[ \] {re.escape(task_name)}'
-    replacement = rf'\1- [x] {task_name} ({datetime.now().strftime("%Y-%m-%d")})'
+    lines = content.splitlines(keepends=True)
+    date = datetime.now().strftime("%Y-%m-%d")
+    
+    # Ищем первую открытую задачу с таким названием вне секции "Выполнено"
+    index = None
+    in_completed = False
+    for i, line in enumerate(lines):
+        if line.startswith('## '):
+            in_completed = line.startswith(COMPLETED_HEADER)
+            continue
+        if not in_completed and _match_task(line, task_name) is not None:
+            index = i
+            break
+    
+    if index is None:
+        print(f"⚠️  Задача '{task_name}' не найдена в списке")
+        return content
     
-    if re.search(pattern, content):
-        content = re.sub(pattern, replacement, content)
-        
-        # Перемещаем задачу в секцию "Выполнено"
-        # Находим секцию "Выполнено"
-        completed_pattern = r'(## ✅ Выполнено.*?)(## 🔄 В работе)'
-        match = re.search(completed_pattern, content, re.DOTALL)
-        
-        if match:
-            completed_section = match.group(1)
-            # Добавляем задачу в конец секции "Выполнено"
-            new_completed_section = completed_section.rstrip() + f'\n- [x] {task_name} ({datetime.now().strftime("%Y-%m-%d")})\n\n'
-            content = re.sub(completed_pattern, new_completed_section + r'\2', content, flags=re.DOTALL)
-        
-        print(f"✅ Задача '{task_name}' отмечена как выполненная")
+    line = lines[index]
+    indent = line[:len(line) - len(line.lstrip())]
+    suffix = _match_task(line, task_name)
+    completed_task = f'{indent}- [x] {task_name}{suffix} ({date})'
+    
+    # Перемещаем задачу в секцию "Выполнено"; если секции нет — отмечаем на месте
+    remaining = lines[:index] + lines[index + 1:]
+    if _insert_into_section(remaining, COMPLETED_HEADER, completed_task):
+        lines = remaining
     else:
-        print(f"⚠️  Задача '{task_name}' не найдена в списке")
+        lines[index] = completed_task + ('\n' if line.endswith('\n') else '')
     
-    return content
+    print(f"✅ Задача '{task_name}' отмечена как выполненная")
+    return ''.join(lines)
 
 def add_new_task(content: str, task_name: str, priority: str = "medium", category: str = "Общее") -> str:
     """Добавить новую задачу."""
@@ -86,15 +137,10 @@ def add_new_task(content: str, task_name: str, priority: str = "medium", categor
     new_task = f"- [ ] {priority_emoji} {task_name}"
     
     # Находим секцию "Предстоит выполнить"
-    todo_pattern = r'(## 📋 Предстоит выполнить.*?)(## 🎯 Приоритеты)'
-    match = re.search(todo_pattern, content, re.DOTALL)
-    
-    if match:
-        todo_section = match.group(1)
-        # Добавляем задачу в конец секции
-        new_todo_section = todo_section.rstrip() + f'\n{new_task}\n\n'
-        content = re.sub(todo_pattern, new_todo_section + r'\2', content, flags=re.DOTALL)
-        
+    lines = content.splitlines(keepends=True)
+    
+    if _insert_into_section(lines, TODO_HEADER, new_task):
+        content = ''.join(lines)
         print(f"➕ Добавлена новая задача: {priority_emoji} {task_name}")
     else:
         print("⚠️  Не удалось найти секцию 'Предстоит выполнить'")
@@ -122,15 +168,18 @@ def update_progress_stats(content: str) -> str:
 
 def update_last_modified(content: str, description: str, next_step: str = ""):
     """Обновить секцию 'Последнее обновление'."""
-    last_modified_pattern = r'(---\n\n\*\*Последнее обновление\*\*: ).*?(\n\*\*Следующий этап\*\*: ).*?(\n)'
-    
-    if next_step:
-        replacement = rf'\1{description}\2{next_step}\3'
-    else:
-        replacement = rf'\1{description}\2Продолжение разработки\3'
-    
-    content = re.sub(last_modified_pattern, replacement, content)
-    return content
+    lines = content.splitlines(keepends=True)
+    next_step = next_step or "Продолжение разработки"
+    
+    for i in range(2, len(lines) - 1):
+        if (lines[i].startswith('**Последнее обновление**: ')
+                and lines[i + 1].startswith('**Следующий этап**: ')
+                and lines[i - 2].rstrip('\n') == '---'
+                and lines[i - 1] == '\n'):
+            lines[i] = f'**Последнее обновление**: {description}\n'
+            lines[i + 1] = f'**Следующий этап**: {next_step}\n'
+    
+    return ''.join(lines)
 
 def show_stats(content: str):
     """Показать текущую статистику."""
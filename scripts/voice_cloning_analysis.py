@@ -21,15 +21,28 @@ from pathlib import Path
 import librosa
 import numpy as np
 
+# Виртуальное окружение Coqui TTS: вместо `source activate` добавляем его bin в PATH
+COQUI_ENV_BIN = Path("coqui_tts_env/bin")
+
+# Частота дискретизации для спектрального анализа и оценки питча
+ANALYSIS_SAMPLE_RATE = 16000
+
 def analyze_audio_file(file_path):
     """Анализ аудиофайла для определения характеристик голоса."""
     try:
-        # Загрузка аудио
+        # Загрузка аудио (librosa сводит в моно)
         y, sr = librosa.load(file_path, sr=None)
+        orig_sr = sr
+        
+        # Для анализа голоса хватает полосы до 8 кГц — понижаем частоту один раз
+        if sr > ANALYSIS_SAMPLE_RATE:
+            y = librosa.resample(y, orig_sr=sr, target_sr=ANALYSIS_SAMPLE_RATE, res_type='soxr_hq')
+            sr = ANALYSIS_SAMPLE_RATE
         
         # Базовые характеристики
         duration = len(y) / sr
-        rms = np.sqrt(np.mean(y**2))
+        # Скалярное произведение без временного массива y**2
+        rms = float(np.sqrt(np.einsum('i,i->', y, y) / y.size))
         
         # Спектральные характеристики
         spectral_centroids = librosa.feature.spectral_centroid(y=y, sr=sr)[0]
@@ -62,7 +75,7 @@ def analyze_audio_file(file_path):
         return {
             "file": file_path,
             "duration": duration,
-            "sample_rate": sr,
+            "sample_rate": orig_sr,
             "rms_energy": rms,
             "avg_spectral_centroid": np.mean(spectral_centroids),
             "avg_spectral_rolloff": np.mean(spectral_rolloff),
@@ -95,9 +108,16 @@ def create_test_samples():
     """Создание тестовых сэмплов с разными настройками."""
     print("\n=== СОЗДАНИЕ ТЕСТОВЫХ СЭМПЛОВ ===")
     
+    tts_bin = str(COQUI_ENV_BIN / "tts")
+    env = {
+        **os.environ,
+        "PATH": f"{COQUI_ENV_BIN.resolve()}{os.pathsep}{os.environ.get('PATH', '')}",
+        "VIRTUAL_ENV": str(COQUI_ENV_BIN.parent.resolve())
+    }
+    
     # Тест 1: Короткий сэмпл
     cmd1 = [
-        "source coqui_tts_env/bin/activate && tts",
+        tts_bin,
         "--text", "Hello!",
         "--model_name", "tts_models/multilingual/multi-dataset/your_tts",
         "--speaker_wav", "data/audio/audio_1@02-12-2020_23-57-46.ogg",
@@ -110,7 +130,7 @@ def create_test_samples():
     
     for i, audio_file in enumerate(audio_files):
         cmd = [
-            "source coqui_tts_env/bin/activate && tts",
+            tts_bin,
             "--text", "Hello! This is a test.",
             "--model_name", "tts_models/multilingual/multi-dataset/your_tts",
             "--speaker_wav", str(audio_file),
@@ -120,9 +140,9 @@ def create_test_samples():
         
         print(f"Создание теста с {audio_file.name}...")
         try:
-            subprocess.run(" ".join(cmd), shell=True, check=True)
+            subprocess.run(cmd, check=True, env=env)
             print(f"✅ Тест {i+1} создан")
-        except subprocess.CalledProcessError as e:
+        except (subprocess.CalledProcessError, OSError) as e:
             print(f"❌ Ошибка в тесте {i+1}: {e}")
 
 def analyze_generated_samples():
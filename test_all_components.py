@@ -8,15 +8,25 @@
 Версия: 1.0.0
 """
 
+import argparse
 import asyncio
-import json
+import concurrent.futures
+import functools
 import logging
-import requests
+import os
+import socket
 import subprocess
 import sys
+import tempfile
 import time
+from array import array
 from datetime import datetime
-from typing import Dict, Any, List
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+import httpx
+
+from test_utils import HTTP2_AVAILABLE, dumps, loads
 
 # Настройка логирования
 logging.basicConfig(
@@ -25,25 +35,182 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Числовые коды статусов для подсчета итогов
+STATUS_CODES = {"success": 0, "warning": 1, "error": 2}
+
+# Время жизни закэшированного результата проверки, сек
+HEALTH_CACHE_TTL = 5.0
+
+# Кэш сохраняется между запусками скрипта (повторные вызовы из CI/мониторинга)
+HEALTH_CACHE_FILE = Path(tempfile.gettempdir()) / "avatar_health_cache.json"
+
+
+def _cached(ttl: float):
+    """Кэширование результата асинхронной проверки на ttl секунд."""
+    def wrap(fn):
+        @functools.wraps(fn)
+        async def inner(self, *args):
+            if not self.use_cache:
+                return await fn(self, *args)
+            
+            # Время по часам системы: сравнивается с записями других процессов
+            now = time.time()
+            cached = self._cache.get(fn.__name__)
+            if cached and 0 <= now - cached[0] < ttl:
+                return cached[1]
+            
+            result = await fn(self, *args)
+            self._cache[fn.__name__] = [now, result]
+            self._cache_dirty = True
+            return result
+        return inner
+    return wrap
+
+
+def _port_listening(port: int, host: str = "127.0.0.1", timeout: float = 0.05) -> bool:
+    """Проверка, принимает ли порт соединения (один connect без обхода таблицы сокетов)."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(timeout)
+        return sock.connect_ex((host, port)) == 0
+    finally:
+        sock.close()
+
+
+def _gpu_probe_worker(detailed_memory: bool = False) -> Dict[str, Any]:
+    """Проверка GPU (выполняется в отдельном процессе: импорт torch тяжелый)."""
+    try:
+        logger.info("🔍 Проверка GPU...")
+        
+        import torch
+        
+        if torch.cuda.is_available():
+            gpu_count = torch.cuda.device_count()
+            props_list = [torch.cuda.get_device_properties(i) for i in range(gpu_count)]
+            
+            gpu_info = [
+                {
+                    "id": i,
+                    "name": props.name,
+                    "memory_total": props.total_memory / 1024**3,  # GB
+                }
+                for i, props in enumerate(props_list)
+            ]
+            
+            if detailed_memory:
+                # Один запрос к драйверу на устройство: свободная и общая память
+                if not torch.cuda.is_initialized():
+                    torch.cuda.init()
+                for info in gpu_info:
+                    free, total = torch.cuda.mem_get_info(info["id"])
+                    info["memory_free"] = free / 1024**3  # GB
+                    info["memory_used"] = (total - free) / 1024**3  # GB
+            
+            logger.info(f"✅ GPU доступен: {gpu_count} устройств")
+            return {
+                "status": "success",
+                "cuda_available": True,
+                "gpu_count": gpu_count,
+                "gpus": gpu_info
+            }
+        else:
+            logger.warning("⚠️ GPU недоступен")
+            return {
+                "status": "warning",
+                "cuda_available": False,
+                "message": "GPU недоступен, будет использоваться CPU"
+            }
+            
+    except ImportError:
+        logger.warning("⚠️ PyTorch не установлен")
+        return {
+            "status": "warning",
+            "error": "PyTorch не установлен"
+        }
+    except Exception as e:
+        logger.error(f"❌ Ошибка проверки GPU: {e}")
+        return {
+            "status": "error",
+            "error": str(e)
+        }
+
 
 class SystemTester:
     """Тестер системы цифрового аватара."""
     
-    def __init__(self):
+    def __init__(self, use_cache: bool = True):
         self.backend_url = "http://127.0.0.1:8000"
-        self.frontend_url = "http://localhost:3000"
+        # Только IPv4 loopback адреса: без DNS запросов и попыток IPv6
+        self.frontend_url = "http://127.0.0.1:3000"
         self.hier_tts_url = "http://127.0.0.1:8001"
         self.test_results = {}
+        self.use_cache = use_cache
+        self._cache: Dict[str, list] = self._load_cache() if use_cache else {}
+        self._cache_dirty = False
+        
+        # Один клиент на все проверки: keep-alive вместо нового соединения на запрос
+        self.client: Optional[httpx.AsyncClient] = None
+        
+        # Отдельный процесс для проверки GPU: импорт torch не блокирует HTTP проверки
+        self._pool = concurrent.futures.ProcessPoolExecutor(max_workers=1)
+        # Процесс-воркер создается лениво при первой задаче: запускаем его сразу,
+        # пока выполняется остальная инициализация
+        self._pool.submit(int)
+    
+    async def start(self):
+        """Создание HTTP клиента."""
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                # local_address="0.0.0.0" ограничивает соединения IPv4;
+                # при своем транспорте пул настраивается только в нем
+                transport=httpx.AsyncHTTPTransport(
+                    http2=HTTP2_AVAILABLE,
+                    limits=httpx.Limits(max_keepalive_connections=16),
+                    local_address="0.0.0.0"
+                ),
+                timeout=5.0
+            )
+    
+    @staticmethod
+    def _load_cache() -> Dict[str, list]:
+        """Чтение кэша проверок предыдущих запусков."""
+        try:
+            cache = loads(HEALTH_CACHE_FILE.read_bytes())
+        except (OSError, ValueError):
+            return {}
+        return cache if isinstance(cache, dict) else {}
+    
+    def _save_cache(self):
+        """Запись кэша проверок для следующих запусков."""
+        if not self._cache_dirty:
+            return
+        # Запись через временный файл: параллельный запуск не прочитает файл наполовину
+        tmp_file = HEALTH_CACHE_FILE.with_name(f"{HEALTH_CACHE_FILE.name}.{os.getpid()}.tmp")
+        try:
+            tmp_file.write_bytes(dumps(self._cache))
+            os.replace(tmp_file, HEALTH_CACHE_FILE)
+        except OSError as e:
+            logger.warning(f"⚠️ Не удалось сохранить кэш проверок: {e}")
+        self._cache_dirty = False
     
-    def test_backend_health(self) -> Dict[str, Any]:
+    async def close(self):
+        """Закрытие HTTP клиента."""
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        self._save_cache()
+    
+    @_cached(HEALTH_CACHE_TTL)
+    async def test_backend_health(self) -> Dict[str, Any]:
         """Тестирование здоровья backend."""
         try:
             logger.info("🔍 Тестирование backend...")
             
-            response = requests.get(f"{self.backend_url}/health", timeout=5)
+            response = await self.client.get(f"{self.backend_url}/health")
             
             if response.status_code == 200:
-                data = response.json()
+                data = loads(response.content)
                 logger.info("✅ Backend работает")
                 return {
                     "status": "success",
@@ -64,14 +231,23 @@ class SystemTester:
                 "error": str(e)
             }
     
-    def test_frontend_health(self) -> Dict[str, Any]:
+    @_cached(HEALTH_CACHE_TTL)
+    async def test_frontend_health(self) -> Dict[str, Any]:
         """Тестирование здоровья frontend."""
         try:
             logger.info("🔍 Тестирование frontend...")
             
-            response = requests.get(self.frontend_url, timeout=5)
+            # Для проверки доступности хватает заголовков — HTML бандл не скачиваем
+            response = await self.client.head(self.frontend_url, follow_redirects=True)
+            if response.status_code in (405, 501):
+                # Dev сервер без поддержки HEAD: запрашиваем один байт
+                response = await self.client.get(
+                    self.frontend_url,
+                    headers={"Range": "bytes=0-0"},
+                    follow_redirects=True
+                )
             
-            if response.status_code == 200:
+            if response.status_code in (200, 206):
                 logger.info("✅ Frontend работает")
                 return {
                     "status": "success",
@@ -91,12 +267,13 @@ class SystemTester:
                 "error": str(e)
             }
     
-    def test_hier_tts(self) -> Dict[str, Any]:
+    @_cached(HEALTH_CACHE_TTL)
+    async def test_hier_tts(self) -> Dict[str, Any]:
         """Тестирование HierSpeech_TTS."""
         try:
             logger.info("🔍 Тестирование HierSpeech_TTS...")
             
-            response = requests.get(f"{self.hier_tts_url}/health", timeout=5)
+            response = await self.client.get(f"{self.hier_tts_url}/health")
             
             if response.status_code == 200:
                 logger.info("✅ HierSpeech_TTS работает")
@@ -118,16 +295,17 @@ class SystemTester:
                 "error": str(e)
             }
     
-    def test_whisper_service(self) -> Dict[str, Any]:
+    @_cached(HEALTH_CACHE_TTL)
+    async def test_whisper_service(self) -> Dict[str, Any]:
         """Тестирование сервиса Whisper."""
         try:
             logger.info("🔍 Тестирование Whisper...")
             
             # Проверяем доступность endpoint
-            response = requests.get(f"{self.backend_url}/api/v1/speech/health", timeout=5)
+            response = await self.client.get(f"{self.backend_url}/api/v1/speech/health")
             
             if response.status_code == 200:
-                data = response.json()
+                data = loads(response.content)
                 logger.info("✅ Whisper API работает")
                 return {
                     "status": "success",
@@ -147,16 +325,17 @@ class SystemTester:
                 "error": str(e)
             }
     
+    @_cached(HEALTH_CACHE_TTL)
     async def test_ollama_service(self) -> Dict[str, Any]:
         """Тестирование сервиса Ollama."""
         try:
             logger.info("🔍 Тестирование Ollama...")
             
             # Проверяем доступность endpoint
-            response = requests.get(f"{self.backend_url}/api/v1/chat/health", timeout=5)
+            response = await self.client.get(f"{self.backend_url}/api/v1/chat/health")
             
             if response.status_code == 200:
-                data = response.json()
+                data = loads(response.content)
                 logger.info("✅ Ollama API работает")
                 return {
                     "status": "success",
@@ -181,19 +360,12 @@ class SystemTester:
         try:
             logger.info("🔍 Проверка портов...")
             
-            import psutil
-            
             ports_to_check = [8000, 3000, 8001]
-            port_status = {}
             
-            for port in ports_to_check:
-                is_used = False
-                for conn in psutil.net_connections():
-                    if conn.laddr.port == port and conn.status == 'LISTEN':
-                        is_used = True
-                        break
-                
-                port_status[f"port_{port}"] = "used" if is_used else "free"
+            port_status = {
+                f"port_{port}": "used" if _port_listening(port) else "free"
+                for port in ports_to_check
+            }
             
             logger.info("✅ Проверка портов завершена")
             return {
@@ -208,140 +380,125 @@ class SystemTester:
                 "error": str(e)
             }
     
-    def test_gpu(self) -> Dict[str, Any]:
+    def test_gpu(self, detailed_memory: bool = False) -> Dict[str, Any]:
         """Тестирование GPU."""
-        try:
-            logger.info("🔍 Проверка GPU...")
-            
-            import torch
-            
-            if torch.cuda.is_available():
-                gpu_count = torch.cuda.device_count()
-                gpu_info = []
-                
-                for i in range(gpu_count):
-                    props = torch.cuda.get_device_properties(i)
-                    gpu_info.append({
-                        "id": i,
-                        "name": props.name,
-                        "memory_total": props.total_memory / 1024**3,  # GB
-                        "memory_allocated": torch.cuda.memory_allocated(i) / 1024**3,  # GB
-                    })
-                
-                logger.info(f"✅ GPU доступен: {gpu_count} устройств")
-                return {
-                    "status": "success",
-                    "cuda_available": True,
-                    "gpu_count": gpu_count,
-                    "gpus": gpu_info
-                }
-            else:
-                logger.warning("⚠️ GPU недоступен")
-                return {
-                    "status": "warning",
-                    "cuda_available": False,
-                    "message": "GPU недоступен, будет использоваться CPU"
-                }
-                
-        except ImportError:
-            logger.warning("⚠️ PyTorch не установлен")
-            return {
-                "status": "warning",
-                "error": "PyTorch не установлен"
-            }
-        except Exception as e:
-            logger.error(f"❌ Ошибка проверки GPU: {e}")
-            return {
-                "status": "error",
-                "error": str(e)
-            }
+        return _gpu_probe_worker(detailed_memory)
     
-    async def run_all_tests(self) -> Dict[str, Any]:
+    async def run_all_tests(self, timestamp_ns: Optional[int] = None) -> Dict[str, Any]:
         """Запуск всех тестов."""
         logger.info("🚀 Запуск комплексного тестирования системы...")
         
         results = {
-            "timestamp": datetime.now().isoformat(),
+            # Время храним числом (нс с начала эпохи), форматируем только при выводе
+            "timestamp_ns": timestamp_ns or time.time_ns(),
             "tests": {}
         }
         
-        # Тестируем компоненты
-        results["tests"]["backend"] = self.test_backend_health()
-        results["tests"]["frontend"] = self.test_frontend_health()
-        results["tests"]["hier_tts"] = self.test_hier_tts()
-        results["tests"]["whisper"] = self.test_whisper_service()
-        results["tests"]["ollama"] = await self.test_ollama_service()
-        results["tests"]["ports"] = self.test_ports()
-        results["tests"]["gpu"] = self.test_gpu()
+        # Проверку GPU запускаем первой: процесс импортирует torch, пока идут HTTP проверки
+        loop = asyncio.get_running_loop()
+        gpu_future = loop.run_in_executor(self._pool, _gpu_probe_worker)
+        
+        await self.start()
+        
+        # Проверки независимы — запускаем одновременно
+        probes = {
+            "backend": self.test_backend_health(),
+            "frontend": self.test_frontend_health(),
+            "hier_tts": self.test_hier_tts(),
+            "whisper": self.test_whisper_service(),
+            "ollama": self.test_ollama_service(),
+            "ports": asyncio.to_thread(self.test_ports),
+            "gpu": gpu_future
+        }
+        results_list = await asyncio.gather(*probes.values(), return_exceptions=True)
+        
+        # Статистику считаем по кодам статусов сразу при сборе результатов
+        counts = array('i', [0] * len(STATUS_CODES))
+        for name, result in zip(probes, results_list):
+            if isinstance(result, BaseException):
+                result = {"status": "error", "error": str(result)}
+            results["tests"][name] = result
+            counts[STATUS_CODES.get(result["status"], STATUS_CODES["error"])] += 1
         
-        # Подсчитываем статистику
         total_tests = len(results["tests"])
-        successful_tests = sum(1 for test in results["tests"].values() if test["status"] == "success")
-        warning_tests = sum(1 for test in results["tests"].values() if test["status"] == "warning")
-        failed_tests = sum(1 for test in results["tests"].values() if test["status"] == "error")
+        successful, warnings, failed = counts
         
         results["summary"] = {
             "total": total_tests,
-            "successful": successful_tests,
-            "warnings": warning_tests,
-            "failed": failed_tests,
-            "success_rate": (successful_tests / total_tests) * 100 if total_tests > 0 else 0
+            "successful": successful,
+            "warnings": warnings,
+            "failed": failed,
+            "success_rate": (successful / total_tests) * 100 if total_tests > 0 else 0
         }
         
         return results
     
     def print_results(self, results: Dict[str, Any]):
         """Вывод результатов тестирования."""
-        print("\n" + "="*60)
-        print("📊 РЕЗУЛЬТАТЫ КОМПЛЕКСНОГО ТЕСТИРОВАНИЯ")
-        print("="*60)
-        print(f"Время тестирования: {results['timestamp']}")
+        out: List[str] = []
+        
+        out.append("\n" + "="*60)
+        out.append("📊 РЕЗУЛЬТАТЫ КОМПЛЕКСНОГО ТЕСТИРОВАНИЯ")
+        out.append("="*60)
+        started = datetime.fromtimestamp(results["timestamp_ns"] / 1e9)
+        out.append(f"Время тестирования: {started.isoformat(timespec='seconds')}")
         
         # Выводим результаты по компонентам
         for component, result in results["tests"].items():
             status_icon = "✅" if result["status"] == "success" else "⚠️" if result["status"] == "warning" else "❌"
-            print(f"\n{status_icon} {component.upper()}: {result['status']}")
+            out.append(f"\n{status_icon} {component.upper()}: {result['status']}")
             
             if result["status"] == "error":
-                print(f"   Ошибка: {result.get('error', 'Неизвестная ошибка')}")
+                out.append(f"   Ошибка: {result.get('error', 'Неизвестная ошибка')}")
             elif result["status"] == "success":
                 if "response_time" in result:
-                    print(f"   Время ответа: {result['response_time']:.3f} сек")
+                    out.append(f"   Время ответа: {result['response_time']:.3f} сек")
         
         # Выводим сводку
         summary = results["summary"]
-        print(f"\n📈 СВОДКА:")
-        print(f"   Всего тестов: {summary['total']}")
-        print(f"   Успешно: {summary['successful']} ✅")
-        print(f"   Предупреждения: {summary['warnings']} ⚠️")
-        print(f"   Ошибки: {summary['failed']} ❌")
-        print(f"   Процент успеха: {summary['success_rate']:.1f}%")
+        out.append(f"\n📈 СВОДКА:")
+        out.append(f"   Всего тестов: {summary['total']}")
+        out.append(f"   Успешно: {summary['successful']} ✅")
+        out.append(f"   Предупреждения: {summary['warnings']} ⚠️")
+        out.append(f"   Ошибки: {summary['failed']} ❌")
+        out.append(f"   Процент успеха: {summary['success_rate']:.1f}%")
         
         # Общая оценка
         if summary["success_rate"] >= 80:
-            print(f"\n🎉 ОТЛИЧНО! Система работает стабильно")
+            out.append(f"\n🎉 ОТЛИЧНО! Система работает стабильно")
         elif summary["success_rate"] >= 60:
-            print(f"\n🔶 ХОРОШО! Есть небольшие проблемы")
+            out.append(f"\n🔶 ХОРОШО! Есть небольшие проблемы")
         else:
-            print(f"\n🔴 ТРЕБУЕТ ВНИМАНИЯ! Много проблем")
+            out.append(f"\n🔴 ТРЕБУЕТ ВНИМАНИЯ! Много проблем")
+        
+        out.append("="*60)
         
-        print("="*60)
+        # Один вызов write вместо множества print
+        sys.stdout.write("\n".join(out) + "\n")
+        sys.stdout.flush()
 
 
 async def main():
     """Основная функция."""
-    tester = SystemTester()
+    parser = argparse.ArgumentParser(description="Комплексное тестирование компонентов системы")
+    parser.add_argument("--no-cache", action="store_true", help="Не использовать кэш результатов проверок")
+    args = parser.parse_args()
+    
+    tester = SystemTester(use_cache=not args.no_cache)
+    
+    # Одно чтение часов для отчета и имени файла
+    started_ns = time.time_ns()
+    file_timestamp = time.strftime("%Y%m%d_%H%M%S", time.localtime(started_ns // 1_000_000_000))
     
     try:
-        results = await tester.run_all_tests()
+        results = await tester.run_all_tests(started_ns)
         tester.print_results(results)
         
         # Сохраняем результаты
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        results_file = f"test_results_{timestamp}.json"
+        results_file = f"test_results_{file_timestamp}.json"
         
-        with open(results_file, 'w', encoding='utf-8') as f:
-            json.dump(results, f, ensure_ascii=False, indent=2)
+        with open(results_file, 'wb') as f:
+            f.write(dumps(results, indent=True))
         
         print(f"\n📄 Результаты сохранены в: {results_file}")
         
@@ -356,6 +513,8 @@ async def main():
     except Exception as e:
         logger.error(f"Ошибка тестирования: {e}")
         sys.exit(3)
+    finally:
+        await tester.close()
 
 
 if __name__ == "__main__":
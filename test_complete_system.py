@@ -16,16 +16,86 @@
 
 import asyncio
 import aiohttp
+import aiohttp.abc
+import functools
 import json
+import socket
+import sys
 import time
-import requests
-from typing import Dict, List, Any
+from typing import Any, Callable, Dict, List, Optional
 import logging
 
+from test_utils import dumps, loads
+
 # Настройка логирования
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+def _is_healthy(data: Any) -> bool:
+    """Проверка ответа health endpoint."""
+    return isinstance(data, dict) and data.get('status') == 'healthy'
+
+# Проверки доступности: (имя теста, сервис, путь, название, проверка JSON ответа)
+PROBES = (
+    ('backend', 'backend', '/health', 'Backend API', _is_healthy),
+    ('hier_tts', 'hier_tts', '/health', 'HierSpeech_TTS', _is_healthy),
+    ('sadtalker', 'sadtalker', '/health', 'SadTalker', _is_healthy),
+    ('frontend', 'frontend', '', 'Frontend', None),
+)
+
+# Максимум одновременно выполняемых тестов
+MAX_CONCURRENT_TESTS = 3
+
+# Имена, которые всегда означают локальную машину
+_LOOPBACK_HOSTS = {'localhost', '127.0.0.1'}
+
+class _LoopbackResolver(aiohttp.abc.AbstractResolver):
+    """Резолвер, отвечающий на loopback имена без вызова getaddrinfo."""
+    
+    def __init__(self):
+        self._fallback = aiohttp.ThreadedResolver()
+    
+    async def resolve(self, host: str, port: int = 0, family: int = socket.AF_INET) -> List[Dict[str, Any]]:
+        if host in _LOOPBACK_HOSTS:
+            return [{
+                'hostname': host,
+                'host': '127.0.0.1',
+                'port': port,
+                'family': socket.AF_INET,
+                'proto': 0,
+                'flags': socket.AI_NUMERICHOST
+            }]
+        return await self._fallback.resolve(host, port, family)
+    
+    async def close(self) -> None:
+        await self._fallback.close()
+
+# Общий пул соединений для всех сессий (создается внутри event loop)
+_CONNECTOR: Optional[aiohttp.TCPConnector] = None
+
+def _get_connector() -> aiohttp.TCPConnector:
+    """Получение общего TCPConnector."""
+    global _CONNECTOR
+    if _CONNECTOR is None or _CONNECTOR.closed:
+        # Все адреса loopback по IPv4 — AAAA запросы не нужны
+        _CONNECTOR = aiohttp.TCPConnector(
+            limit=64,
+            limit_per_host=8,
+            ttl_dns_cache=600,
+            use_dns_cache=True,
+            keepalive_timeout=60,
+            family=socket.AF_INET,
+            resolver=_LoopbackResolver()
+        )
+    return _CONNECTOR
+
+async def _close_connector():
+    """Закрытие общего TCPConnector."""
+    global _CONNECTOR
+    if _CONNECTOR is not None:
+        await _CONNECTOR.close()
+        _CONNECTOR = None
+
 class AvatarSystemTester:
     """Тестер системы цифрового аватара."""
     
@@ -38,78 +108,57 @@ class AvatarSystemTester:
             'frontend': 'http://127.0.0.1:3001'
         }
         self.results = {}
+        self.session: Optional[aiohttp.ClientSession] = None
+    
+    async def start(self):
+        """Создание общей HTTP сессии для всех тестов."""
+        if self.session is None:
+            self.session = aiohttp.ClientSession(
+                connector=_get_connector(),
+                connector_owner=False
+            )
+    
+    async def close(self):
+        """Закрытие HTTP сессии."""
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
         
-    async def test_backend(self) -> Dict[str, Any]:
-        """Тест backend API."""
-        logger.info("🔧 Тестирование Backend API...")
+    async def _probe(self, url: str, title: str, validator: Optional[Callable[[Any], bool]]) -> Dict[str, Any]:
+        """Общая проверка доступности сервиса по HTTP."""
+        logger.info(f"🔍 Тестирование {title}...")
         
+        timeout = aiohttp.ClientTimeout(total=5)
         try:
-            # Health check
-            response = await self._make_request(f"{self.base_urls['backend']}/health")
-            if response and response.get('status') == 'healthy':
-                logger.info("✅ Backend API работает")
-                return {'status': 'success', 'message': 'Backend API работает'}
-            else:
-                logger.error("❌ Backend API не отвечает")
-                return {'status': 'error', 'message': 'Backend API не отвечает'}
+            if validator is None:
+                # Тело не нужно — проверяем только статус через HEAD
+                async with self.session.head(url, allow_redirects=True, timeout=timeout) as response:
+                    status = response.status
+                if status in (405, 501):
+                    # Сервер без поддержки HEAD: запрашиваем один байт
+                    async with self.session.get(url, headers={'Range': 'bytes=0-0'}, timeout=timeout) as response:
+                        status = response.status
+                if status not in (200, 206):
+                    logger.error(f"❌ {title} недоступен: {status}")
+                    return {'status': 'error', 'message': f'{title} недоступен: {status}'}
                 
-        except Exception as e:
-            logger.error(f"❌ Ошибка тестирования Backend: {e}")
-            return {'status': 'error', 'message': str(e)}
-    
-    async def test_hier_tts(self) -> Dict[str, Any]:
-        """Тест HierSpeech_TTS."""
-        logger.info("🎤 Тестирование HierSpeech_TTS...")
-        
-        try:
-            # Health check
-            response = await self._make_request(f"{self.base_urls['hier_tts']}/health")
-            if response and response.get('status') == 'healthy':
-                logger.info("✅ HierSpeech_TTS работает")
-                return {'status': 'success', 'message': 'HierSpeech_TTS работает'}
-            else:
-                logger.error("❌ HierSpeech_TTS не отвечает")
-                return {'status': 'error', 'message': 'HierSpeech_TTS не отвечает'}
+                logger.info(f"✅ {title} работает")
+                return {'status': 'success', 'message': f'{title} работает'}
+            
+            async with self.session.get(url, timeout=timeout) as response:
+                if response.status != 200:
+                    logger.error(f"❌ {title} недоступен: {response.status}")
+                    return {'status': 'error', 'message': f'{title} недоступен: {response.status}'}
                 
-        except Exception as e:
-            logger.error(f"❌ Ошибка тестирования HierSpeech_TTS: {e}")
-            return {'status': 'error', 'message': str(e)}
-    
-    async def test_sadtalker(self) -> Dict[str, Any]:
-        """Тест SadTalker."""
-        logger.info("🎭 Тестирование SadTalker...")
-        
-        try:
-            # Health check
-            response = await self._make_request(f"{self.base_urls['sadtalker']}/health")
-            if response and response.get('status') == 'healthy':
-                logger.info("✅ SadTalker работает")
-                return {'status': 'success', 'message': 'SadTalker работает'}
-            else:
-                logger.error("❌ SadTalker не отвечает")
-                return {'status': 'error', 'message': 'SadTalker не отвечает'}
+                if not validator(await response.json(loads=loads)):
+                    logger.error(f"❌ {title} не отвечает")
+                    return {'status': 'error', 'message': f'{title} не отвечает'}
+                
+                logger.info(f"✅ {title} работает")
+                return {'status': 'success', 'message': f'{title} работает'}
                 
         except Exception as e:
-            logger.error(f"❌ Ошибка тестирования SadTalker: {e}")
-            return {'status': 'error', 'message': str(e)}
-    
-    async def test_frontend(self) -> Dict[str, Any]:
-        """Тест Frontend."""
-        logger.info("🌐 Тестирование Frontend...")
-        
-        try:
-            # Проверка доступности
-            async with aiohttp.ClientSession() as session:
-                async with session.get(self.base_urls['frontend']) as response:
-                    if response.status == 200:
-                        logger.info("✅ Frontend доступен")
-                        return {'status': 'success', 'message': 'Frontend доступен'}
-                    else:
-                        logger.error(f"❌ Frontend недоступен: {response.status}")
-                        return {'status': 'error', 'message': f'Frontend недоступен: {response.status}'}
-                        
-        except Exception as e:
-            logger.error(f"❌ Ошибка тестирования Frontend: {e}")
+            logger.error(f"❌ Ошибка тестирования {title}: {e}")
             return {'status': 'error', 'message': str(e)}
     
     async def test_websocket(self) -> Dict[str, Any]:
@@ -146,26 +195,27 @@ class AvatarSystemTester:
             test_text = "Привет! Это тест синтеза речи."
             
             # Запрос на синтез
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    f"{self.base_urls['hier_tts']}/synthesize",
-                    json={
-                        'text': test_text,
-                        'language': 'ru',
-                        'reference_audio': 'default'
-                    }
-                ) as response:
-                    if response.status == 200:
-                        audio_data = await response.read()
-                        if len(audio_data) > 0:
-                            logger.info("✅ Синтез речи работает")
-                            return {'status': 'success', 'message': 'Синтез речи работает'}
-                        else:
-                            logger.error("❌ Пустой аудио ответ")
-                            return {'status': 'error', 'message': 'Пустой аудио ответ'}
+            async with self.session.post(
+                f"{self.base_urls['hier_tts']}/synthesize",
+                json={
+                    'text': test_text,
+                    'language': 'ru',
+                    'reference_audio': 'default'
+                }
+            ) as response:
+                if response.status == 200:
+                    # Для проверки достаточно первого блока данных, весь WAV не читаем
+                    first_chunk = await response.content.readany()
+                    response.close()
+                    if first_chunk:
+                        logger.info("✅ Синтез речи работает")
+                        return {'status': 'success', 'message': 'Синтез речи работает'}
                     else:
-                        logger.error(f"❌ Ошибка синтеза речи: {response.status}")
-                        return {'status': 'error', 'message': f'Ошибка синтеза речи: {response.status}'}
+                        logger.error("❌ Пустой аудио ответ")
+                        return {'status': 'error', 'message': 'Пустой аудио ответ'}
+                else:
+                    logger.error(f"❌ Ошибка синтеза речи: {response.status}")
+                    return {'status': 'error', 'message': f'Ошибка синтеза речи: {response.status}'}
                         
         except Exception as e:
             logger.error(f"❌ Ошибка тестирования синтеза речи: {e}")
@@ -179,101 +229,107 @@ class AvatarSystemTester:
             # Тестовое сообщение
             test_message = "Привет! Как дела?"
             
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    f"{self.base_urls['backend']}/api/v1/chat/chat",
-                    json={
-                        'message': test_message,
-                        'model': 'llama3.2:3b',
-                        'max_tokens': 100,
-                        'temperature': 0.7
-                    }
-                ) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        if 'response' in result and len(result['response']) > 0:
-                            logger.info("✅ AI чат работает")
-                            return {'status': 'success', 'message': 'AI чат работает'}
-                        else:
-                            logger.error("❌ Пустой ответ от AI")
-                            return {'status': 'error', 'message': 'Пустой ответ от AI'}
+            async with self.session.post(
+                f"{self.base_urls['backend']}/api/v1/chat/chat",
+                data=dumps({
+                    'message': test_message,
+                    'model': 'llama3.2:3b',
+                    'max_tokens': 100,
+                    'temperature': 0.7
+                }),
+                headers={'Content-Type': 'application/json'}
+            ) as response:
+                if response.status == 200:
+                    result = await response.json(loads=loads)
+                    if 'response' in result and len(result['response']) > 0:
+                        logger.info("✅ AI чат работает")
+                        return {'status': 'success', 'message': 'AI чат работает'}
                     else:
-                        logger.error(f"❌ Ошибка AI чата: {response.status}")
-                        return {'status': 'error', 'message': f'Ошибка AI чата: {response.status}'}
+                        logger.error("❌ Пустой ответ от AI")
+                        return {'status': 'error', 'message': 'Пустой ответ от AI'}
+                else:
+                    logger.error(f"❌ Ошибка AI чата: {response.status}")
+                    return {'status': 'error', 'message': f'Ошибка AI чата: {response.status}'}
                         
         except Exception as e:
             logger.error(f"❌ Ошибка тестирования AI чата: {e}")
             return {'status': 'error', 'message': str(e)}
     
-    async def _make_request(self, url: str) -> Dict[str, Any]:
-        """Выполнение HTTP запроса."""
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url) as response:
-                    if response.status == 200:
-                        return await response.json()
-                    else:
-                        return None
-        except Exception:
-            return None
-    
     async def run_all_tests(self) -> Dict[str, Any]:
         """Запуск всех тестов."""
         logger.info("🚀 Запуск комплексного тестирования системы...")
         
         tests = [
-            ('backend', self.test_backend),
-            ('hier_tts', self.test_hier_tts),
-            ('sadtalker', self.test_sadtalker),
-            ('frontend', self.test_frontend),
+            (name, functools.partial(self._probe, self.base_urls[service] + path, title, validator))
+            for name, service, path, title, validator in PROBES
+        ]
+        tests += [
             ('websocket', self.test_websocket),
             ('audio_synthesis', self.test_audio_synthesis),
             ('ai_chat', self.test_ai_chat)
         ]
         
-        for test_name, test_func in tests:
-            self.results[test_name] = await test_func()
-            await asyncio.sleep(1)  # Пауза между тестами
+        # Ограничиваем число одновременных проверок, чтобы не перегружать сервисы
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_TESTS)
+        
+        async def guarded(test_func):
+            async with semaphore:
+                return await test_func()
+        
+        results = await asyncio.gather(*(guarded(test_func) for _, test_func in tests))
+        for (test_name, _), result in zip(tests, results):
+            self.results[test_name] = result
         
         return self.results
     
     def print_results(self):
         """Вывод результатов тестирования."""
-        print("\n" + "="*60)
-        print("📊 РЕЗУЛЬТАТЫ ТЕСТИРОВАНИЯ СИСТЕМЫ ЦИФРОВОГО АВАТАРА")
-        print("="*60)
+        out: List[str] = []
+        
+        out.append("\n" + "="*60)
+        out.append("📊 РЕЗУЛЬТАТЫ ТЕСТИРОВАНИЯ СИСТЕМЫ ЦИФРОВОГО АВАТАРА")
+        out.append("="*60)
         
         total_tests = len(self.results)
         successful_tests = sum(1 for result in self.results.values() if result['status'] == 'success')
         
         for test_name, result in self.results.items():
             status_icon = "✅" if result['status'] == 'success' else "❌"
-            print(f"{status_icon} {test_name.upper()}: {result['message']}")
+            out.append(f"{status_icon} {test_name.upper()}: {result['message']}")
         
-        print("\n" + "-"*60)
-        print(f"📈 ИТОГО: {successful_tests}/{total_tests} тестов прошли успешно")
+        out.append("\n" + "-"*60)
+        out.append(f"📈 ИТОГО: {successful_tests}/{total_tests} тестов прошли успешно")
         
         if successful_tests == total_tests:
-            print("🎉 ВСЕ КОМПОНЕНТЫ РАБОТАЮТ ОТЛИЧНО!")
+            out.append("🎉 ВСЕ КОМПОНЕНТЫ РАБОТАЮТ ОТЛИЧНО!")
         elif successful_tests >= total_tests * 0.7:
-            print("⚠️  БОЛЬШИНСТВО КОМПОНЕНТОВ РАБОТАЮТ")
+            out.append("⚠️  БОЛЬШИНСТВО КОМПОНЕНТОВ РАБОТАЮТ")
         else:
-            print("🚨 МНОГО ПРОБЛЕМ - ТРЕБУЕТСЯ ДИАГНОСТИКА")
+            out.append("🚨 МНОГО ПРОБЛЕМ - ТРЕБУЕТСЯ ДИАГНОСТИКА")
+        
+        out.append("="*60)
         
-        print("="*60)
+        # Один вызов write вместо множества print
+        sys.stdout.write("\n".join(out) + "\n")
+        sys.stdout.flush()
 
 async def main():
     """Основная функция."""
     tester = AvatarSystemTester()
-    results = await tester.run_all_tests()
+    await tester.start()
+    try:
+        results = await tester.run_all_tests()
+    finally:
+        await tester.close()
+        await _close_connector()
     tester.print_results()
     
     # Сохранение результатов
     timestamp = time.strftime("%Y%m%d_%H%M%S")
     filename = f"complete_system_test_results_{timestamp}.json"
     
-    with open(filename, 'w', encoding='utf-8') as f:
-        json.dump(results, f, ensure_ascii=False, indent=2)
+    with open(filename, 'wb') as f:
+        f.write(dumps(results, indent=True))
     
     print(f"\n📄 Результаты сохранены в файл: {filename}")
 
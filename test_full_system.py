@@ -15,21 +15,58 @@
 """
 
 import asyncio
-import json
+import aiohttp
+import atexit
+import io
+from concurrent.futures import ThreadPoolExecutor
 import time
-import requests
+import httpx
 import websockets
 import logging
+import logging.handlers
+import queue
+import socket
 from pathlib import Path
 from typing import Dict, Any, Optional
 
+from test_utils import dumps, make_client
+
+try:
+    # Цикл событий на libuv: меньше накладных расходов на колбэки
+    import uvloop
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+except ImportError:
+    pass
+
+def _ws_dumps(obj: Any) -> str:
+    """Сериализация сообщения WebSocket (orjson, если установлен)."""
+    return dumps(obj).decode('utf-8')
+
 # Настройка логирования
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# Тесты пишут лог из нескольких потоков: записи уходят в очередь,
+# а в stderr их выводит отдельный поток QueueListener
+_log_queue = queue.SimpleQueue()
+_log_stream_handler = logging.StreamHandler()
+_log_stream_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+_log_listener = logging.handlers.QueueListener(_log_queue, _log_stream_handler)
+_log_listener.start()
+atexit.register(_log_listener.stop)
+# QueueHandler передает только текст сообщения, полный формат применяет StreamHandler
+logging.basicConfig(level=logging.INFO, format='%(message)s', handlers=[logging.handlers.QueueHandler(_log_queue)])
 logger = logging.getLogger(__name__)
 
+# Тестовые данные для SadTalker
+SADTALKER_IMAGE_PATH = Path("SadTalker/examples/source_image/avatar.jpg")
+SADTALKER_AUDIO_PATH = Path("SadTalker/examples/driven_audio/test.wav")
+
 class AvatarSystemTester:
     """Тестер системы цифрового аватара."""
     
+    # Тестовые данные SadTalker (общие для всех экземпляров)
+    _fixtures_ready = False
+    _img_bytes = b""
+    _audio_bytes = b""
+    
     def __init__(self):
         self.base_urls = {
             'backend': 'http://localhost:8000',
@@ -38,184 +75,288 @@ class AvatarSystemTester:
             'frontend': 'http://localhost:3000'
         }
         self.test_results = {}
+        # Одна сессия на все проверки: соединения с сервисами переиспользуются
+        self.client = make_client()
+        # Асинхронная сессия для тестов, выполняемых в event loop
+        self._aio_session: Optional[aiohttp.ClientSession] = None
+        # Одно WebSocket соединение на все тесты
+        self._ws_conn = None
+    
+    async def _ensure_session(self) -> aiohttp.ClientSession:
+        """Ленивое создание общей aiohttp сессии."""
+        if self._aio_session is None or self._aio_session.closed:
+            self._aio_session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=32, ttl_dns_cache=300, force_close=False)
+            )
+        return self._aio_session
+    
+    async def _close_aio_session(self):
+        """Закрытие aiohttp сессии."""
+        if self._aio_session is not None:
+            await self._aio_session.close()
+            self._aio_session = None
+    
+    async def _ws(self):
+        """Ленивое открытие общего WebSocket соединения."""
+        if self._ws_conn is None:
+            # Без permessage-deflate и фоновых ping: сообщения тестов маленькие
+            self._ws_conn = await websockets.connect(
+                "ws://localhost:8000/ws",
+                max_size=2**20,
+                compression=None,
+                ping_interval=None
+            )
+            # Маленькие кадры отправляются сразу, без задержки алгоритма Нейгла
+            sock = self._ws_conn.transport.get_extra_info('socket')
+            if sock is not None:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return self._ws_conn
+    
+    async def _close_ws(self):
+        """Закрытие WebSocket соединения."""
+        # Сбрасываем ссылку до close(): на оборванном соединении он может завершиться ошибкой
+        conn, self._ws_conn = self._ws_conn, None
+        if conn is not None:
+            await conn.close()
+    
+    def close(self):
+        """Закрытие HTTP клиента."""
+        self.client.close()
+        
+    def _probe(self, service: str, url: str) -> bool:
+        """Проверка health endpoint одного сервиса."""
+        try:
+            response = self.client.get(f"{url}/health", timeout=5)
+            if response.status_code == 200:
+                data = response.json()
+                logger.info(f"✅ {service}: {data.get('status', 'OK')}")
+                return True
+            logger.error(f"❌ {service}: HTTP {response.status_code}")
+            return False
+        except Exception as e:
+            logger.error(f"❌ {service}: {e}")
+            return False
+    
+    def _warmup(self):
+        """Открытие соединений со всеми сервисами до запуска тестов."""
+        def head(url: str):
+            try:
+                self.client.head(url, timeout=2)
+            except httpx.HTTPError:
+                pass  # Недоступный сервис покажут сами тесты
         
+        with ThreadPoolExecutor(max_workers=len(self.base_urls)) as executor:
+            list(executor.map(head, self.base_urls.values()))
+    
     def test_health_endpoints(self) -> bool:
         """Тестирование health endpoints всех сервисов."""
         logger.info("🔍 Тестирование health endpoints...")
         
-        all_healthy = True
+        # Сервисы независимы — опрашиваем одновременно
+        with ThreadPoolExecutor(max_workers=len(self.base_urls)) as executor:
+            healthy = list(executor.map(self._probe, self.base_urls.keys(), self.base_urls.values()))
         
-        for service, url in self.base_urls.items():
-            try:
-                response = requests.get(f"{url}/health", timeout=5)
-                if response.status_code == 200:
-                    data = response.json()
-                    logger.info(f"✅ {service}: {data.get('status', 'OK')}")
-                    self.test_results[f"{service}_health"] = True
-                else:
-                    logger.error(f"❌ {service}: HTTP {response.status_code}")
-                    self.test_results[f"{service}_health"] = False
-                    all_healthy = False
-            except Exception as e:
-                logger.error(f"❌ {service}: {e}")
-                self.test_results[f"{service}_health"] = False
-                all_healthy = False
+        for service, ok in zip(self.base_urls, healthy):
+            self.test_results[f"{service}_health"] = ok
         
-        return all_healthy
+        return all(healthy)
     
-    def test_websocket_connection(self) -> bool:
+    async def test_websocket_connection(self) -> bool:
         """Тестирование WebSocket соединения."""
         logger.info("🔌 Тестирование WebSocket соединения...")
         
         try:
-            async def test_ws():
-                uri = "ws://localhost:8000/ws"
-                async with websockets.connect(uri) as websocket:
-                    # Отправка тестового сообщения
-                    test_message = {
-                        "type": "test",
-                        "message": "Тестовое сообщение"
-                    }
-                    await websocket.send(json.dumps(test_message))
-                    
-                    # Получение ответа
-                    response = await asyncio.wait_for(websocket.recv(), timeout=5.0)
-                    logger.info(f"✅ WebSocket ответ: {response}")
-                    return True
+            websocket = await self._ws()
             
-            result = asyncio.run(test_ws())
-            self.test_results["websocket"] = result
-            return result
+            # Отправка тестового сообщения
+            test_message = {
+                "type": "test",
+                "message": "Тестовое сообщение"
+            }
+            await websocket.send(_ws_dumps(test_message))
             
+            # Получение ответа
+            response = await asyncio.wait_for(websocket.recv(), timeout=5.0)
+            logger.info(f"✅ WebSocket ответ: {response}")
+            
+            self.test_results["websocket"] = True
+            return True
+            
+        except asyncio.TimeoutError:
+            # Опоздавший ответ остался бы в соединении и был бы принят за ответ следующего теста
+            await self._close_ws()
+            logger.error("❌ WebSocket ошибка: нет ответа за 5 сек")
+            self.test_results["websocket"] = False
+            return False
         except Exception as e:
+            # Соединение в неизвестном состоянии: следующий тест откроет новое
+            await self._close_ws()
             logger.error(f"❌ WebSocket ошибка: {e}")
             self.test_results["websocket"] = False
             return False
     
-    def test_whisper_integration(self) -> bool:
+    async def test_whisper_integration(self) -> bool:
         """Тестирование интеграции Whisper."""
         logger.info("🎤 Тестирование Whisper (распознавание речи)...")
         
         try:
-            # Проверяем health endpoint вместо реальной транскрипции
-            response = requests.get(f"{self.base_urls['backend']}/api/v1/speech/health", timeout=10)
+            session = await self._ensure_session()
             
-            if response.status_code == 200:
-                result = response.json()
-                logger.info(f"✅ Whisper health: {result}")
-                self.test_results["whisper"] = True
-                return True
-            else:
-                logger.error(f"❌ Whisper health ошибка: {response.status_code}")
-                self.test_results["whisper"] = False
-                return False
+            # Проверяем health endpoint вместо реальной транскрипции
+            async with session.get(
+                f"{self.base_urls['backend']}/api/v1/speech/health",
+                timeout=aiohttp.ClientTimeout(total=10)
+            ) as response:
+                if response.status == 200:
+                    result = await response.json(content_type=None)
+                    logger.info(f"✅ Whisper health: {result}")
+                    self.test_results["whisper"] = True
+                    return True
+                else:
+                    logger.error(f"❌ Whisper health ошибка: {response.status}")
+                    self.test_results["whisper"] = False
+                    return False
                 
         except Exception as e:
             logger.error(f"❌ Whisper тест ошибка: {e}")
             self.test_results["whisper"] = False
             return False
     
-    def test_ollama_integration(self) -> bool:
+    async def test_ollama_integration(self) -> bool:
         """Тестирование интеграции Ollama."""
         logger.info("🧠 Тестирование Ollama (генерация ответов)...")
         
         try:
             test_message = "Привет! Как дела?"
+            session = await self._ensure_session()
             
-            response = requests.post(
+            async with session.post(
                 f"{self.base_urls['backend']}/api/v1/chat/chat",
                 json={"message": test_message},
-                timeout=30
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                logger.info(f"✅ Ollama ответ: {result.get('response', '')[:100]}...")
-                self.test_results["ollama"] = True
-                return True
-            else:
-                logger.error(f"❌ Ollama ошибка: {response.status_code}")
-                self.test_results["ollama"] = False
-                return False
+                timeout=aiohttp.ClientTimeout(total=30)
+            ) as response:
+                if response.status == 200:
+                    result = await response.json(content_type=None)
+                    logger.info(f"✅ Ollama ответ: {result.get('response', '')[:100]}...")
+                    self.test_results["ollama"] = True
+                    return True
+                else:
+                    logger.error(f"❌ Ollama ошибка: {response.status}")
+                    self.test_results["ollama"] = False
+                    return False
                 
         except Exception as e:
             logger.error(f"❌ Ollama тест ошибка: {e}")
             self.test_results["ollama"] = False
             return False
     
-    def test_hier_tts_integration(self) -> bool:
+    async def test_hier_tts_integration(self) -> bool:
         """Тестирование интеграции HierSpeech_TTS."""
         logger.info("🎵 Тестирование HierSpeech_TTS (синтез речи)...")
         
         try:
             test_text = "Привет! Это тестовое сообщение для синтеза речи."
+            session = await self._ensure_session()
             
-            response = requests.post(
+            async with session.post(
                 f"{self.base_urls['hier_tts']}/synthesize",
                 json={
                     "text": test_text,
                     "voice_id": "female_001",
                     "speed": 1.0
                 },
-                timeout=30
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                logger.info(f"✅ HierSpeech_TTS результат: {result.get('status', 'OK')}")
-                self.test_results["hier_tts"] = True
-                return True
-            else:
-                logger.error(f"❌ HierSpeech_TTS ошибка: {response.status_code}")
-                self.test_results["hier_tts"] = False
-                return False
+                timeout=aiohttp.ClientTimeout(total=30)
+            ) as response:
+                if response.status == 200:
+                    result = await response.json(content_type=None)
+                    logger.info(f"✅ HierSpeech_TTS результат: {result.get('status', 'OK')}")
+                    self.test_results["hier_tts"] = True
+                    return True
+                else:
+                    logger.error(f"❌ HierSpeech_TTS ошибка: {response.status}")
+                    self.test_results["hier_tts"] = False
+                    return False
                 
         except Exception as e:
             logger.error(f"❌ HierSpeech_TTS тест ошибка: {e}")
             self.test_results["hier_tts"] = False
             return False
     
+    @staticmethod
+    def _load_avatar_bytes() -> bytes:
+        """Тестовое изображение в формате JPEG."""
+        try:
+            return SADTALKER_IMAGE_PATH.read_bytes()
+        except FileNotFoundError:
+            pass
+        
+        logger.warning(f"⚠️ Тестовое изображение не найдено: {SADTALKER_IMAGE_PATH}, используется заглушка")
+        import numpy as np
+        # Фиксированный seed: одинаковое изображение при каждом запуске
+        rng = np.random.default_rng(0)
+        pixels = rng.integers(0, 256, size=(512, 512, 3), dtype=np.uint8)
+        
+        try:
+            # OpenCV кодирует JPEG через libjpeg-turbo
+            import cv2
+            ok, encoded = cv2.imencode('.jpg', pixels, [int(cv2.IMWRITE_JPEG_QUALITY), 80])
+            if ok:
+                return encoded.tobytes()
+        except ImportError:
+            pass
+        
+        from PIL import Image
+        buf = io.BytesIO()
+        Image.fromarray(pixels).save(buf, 'JPEG', quality=80)
+        return buf.getvalue()
+    
+    @staticmethod
+    def _load_audio_bytes() -> bytes:
+        """Тестовое аудио в формате WAV."""
+        try:
+            return SADTALKER_AUDIO_PATH.read_bytes()
+        except FileNotFoundError:
+            pass
+        
+        logger.warning(f"⚠️ Тестовое аудио не найдено: {SADTALKER_AUDIO_PATH}, используется заглушка")
+        import numpy as np
+        import soundfile as sf
+        sample_rate = 16000
+        duration = 3.0
+        # float32 и вычисления на месте: один буфер вместо нескольких временных массивов
+        t = np.arange(int(sample_rate * duration), dtype=np.float32)
+        t *= np.float32(2 * np.pi * 440 / sample_rate)
+        audio_data = np.sin(t, out=t)
+        audio_data *= np.float32(0.1)
+        buf = io.BytesIO()
+        # 16-бит PCM: вдвое меньше данных, чем float32
+        sf.write(buf, audio_data, sample_rate, format='WAV', subtype='PCM_16')
+        return buf.getvalue()
+    
+    @classmethod
+    def _prepare_fixtures(cls):
+        """Однократная подготовка тестовых данных для всех экземпляров тестера."""
+        cls._img_bytes = cls._load_avatar_bytes()
+        cls._audio_bytes = cls._load_audio_bytes()
+        cls._fixtures_ready = True
+    
     def test_sadtalker_integration(self) -> bool:
         """Тестирование интеграции SadTalker."""
         logger.info("🎭 Тестирование SadTalker (анимация лица)...")
         
         try:
-            # Проверяем наличие тестовых файлов
-            image_path = "SadTalker/examples/source_image/avatar.jpg"
-            audio_path = "SadTalker/examples/driven_audio/test.wav"
-            
-            if not Path(image_path).exists():
-                logger.warning(f"⚠️ Тестовое изображение не найдено: {image_path}")
-                # Создаем заглушку
-                import numpy as np
-                from PIL import Image
-                test_image = Image.fromarray(np.random.randint(0, 255, (512, 512, 3), dtype=np.uint8))
-                test_image.save(image_path)
-                logger.info(f"✅ Создано тестовое изображение: {image_path}")
-            
-            if not Path(audio_path).exists():
-                logger.warning(f"⚠️ Тестовое аудио не найдено: {audio_path}")
-                # Создаем заглушку
-                import numpy as np
-                import soundfile as sf
-                sample_rate = 16000
-                duration = 3.0
-                t = np.linspace(0, duration, int(sample_rate * duration), False)
-                audio_data = np.sin(2 * np.pi * 440 * t) * 0.1
-                sf.write(audio_path, audio_data, sample_rate)
-                logger.info(f"✅ Создано тестовое аудио: {audio_path}")
-            
-            # Отправка на анимацию
-            with open(image_path, 'rb') as img_file, open(audio_path, 'rb') as audio_file:
-                files = {
-                    'image': ('avatar.jpg', img_file, 'image/jpeg'),
-                    'audio': ('test.wav', audio_file, 'audio/wav')
-                }
-                response = requests.post(
-                    f"{self.base_urls['sadtalker']}/animate",
-                    files=files,
-                    timeout=60
-                )
+            # Данные готовятся один раз, дальше без обращений к диску
+            if not self._fixtures_ready:
+                self._prepare_fixtures()
+            files = {
+                'image': ('avatar.jpg', io.BytesIO(self._img_bytes), 'image/jpeg'),
+                'audio': ('test.wav', io.BytesIO(self._audio_bytes), 'audio/wav')
+            }
+            response = self.client.post(
+                f"{self.base_urls['sadtalker']}/animate",
+                files=files,
+                timeout=60
+            )
             
             if response.status_code == 200:
                 result = response.json()
@@ -232,7 +373,7 @@ class AvatarSystemTester:
             self.test_results["sadtalker"] = False
             return False
     
-    def test_full_pipeline(self) -> bool:
+    async def test_full_pipeline(self) -> bool:
         """Тестирование полного пайплайна."""
         logger.info("🔄 Тестирование полного пайплайна...")
         
@@ -241,31 +382,34 @@ class AvatarSystemTester:
             test_message = "Привет! Расскажи анекдот."
             
             # 1. Отправка сообщения через WebSocket
-            async def test_full_cycle():
-                uri = "ws://localhost:8000/ws"
-                async with websockets.connect(uri) as websocket:
-                    # Отправка текстового сообщения
-                    message = {
-                        "type": "text_message",
-                        "message": test_message
-                    }
-                    await websocket.send(json.dumps(message))
-                    
-                    # Ожидание ответа
-                    response = await asyncio.wait_for(websocket.recv(), timeout=60.0)
-                    logger.info(f"✅ Полный цикл ответ: {response[:200]}...")
-                    return True
+            websocket = await self._ws()
             
-            result = asyncio.run(test_full_cycle())
-            self.test_results["full_pipeline"] = result
-            return result
+            # Отправка текстового сообщения
+            message = {
+                "type": "text_message",
+                "message": test_message
+            }
+            await websocket.send(_ws_dumps(message))
             
+            # Ожидание ответа
+            response = await asyncio.wait_for(websocket.recv(), timeout=60.0)
+            logger.info(f"✅ Полный цикл ответ: {response[:200]}...")
+            
+            self.test_results["full_pipeline"] = True
+            return True
+            
+        except asyncio.TimeoutError:
+            await self._close_ws()
+            logger.error("❌ Полный пайплайн ошибка: нет ответа за 60 сек")
+            self.test_results["full_pipeline"] = False
+            return False
         except Exception as e:
+            await self._close_ws()
             logger.error(f"❌ Полный пайплайн ошибка: {e}")
             self.test_results["full_pipeline"] = False
             return False
     
-    def run_all_tests(self) -> Dict[str, Any]:
+    async def run_all_tests(self) -> Dict[str, Any]:
         """Запуск всех тестов."""
         logger.info("🚀 Начало комплексного тестирования системы цифрового аватара")
         logger.info("=" * 60)
@@ -273,31 +417,58 @@ class AvatarSystemTester:
         start_time = time.time()
         
         # Тестирование компонентов
-        tests = [
+        # Независимые проверки разных сервисов
+        independent_tests = [
             ("Health Endpoints", self.test_health_endpoints),
             ("WebSocket", self.test_websocket_connection),
             ("Whisper", self.test_whisper_integration),
             ("Ollama", self.test_ollama_integration),
             ("HierSpeech_TTS", self.test_hier_tts_integration),
-            ("SadTalker", self.test_sadtalker_integration),
+            ("SadTalker", self.test_sadtalker_integration)
+        ]
+        # Полный пайплайн имеет смысл только после проверки компонентов
+        pipeline_tests = [
             ("Full Pipeline", self.test_full_pipeline)
         ]
+        # Итог по каждому тесту; self.test_results хранит детальные проверки
+        # (например, отдельный health каждого сервиса)
+        per_test_results: Dict[str, bool] = {}
         
-        for test_name, test_func in tests:
+        async def run_test(test_name, test_func):
             logger.info(f"\n📋 Тест: {test_name}")
             logger.info("-" * 40)
             
             try:
-                result = test_func()
+                # Блокирующие тесты (requests, файлы) выполняются в потоке
+                if asyncio.iscoroutinefunction(test_func):
+                    result = await test_func()
+                else:
+                    result = await asyncio.to_thread(test_func)
                 status = "✅ ПРОЙДЕН" if result else "❌ ПРОВАЛЕН"
                 logger.info(f"{status}: {test_name}")
             except Exception as e:
                 logger.error(f"❌ ОШИБКА: {test_name} - {e}")
                 self.test_results[test_name.lower().replace(" ", "_")] = False
+                result = False
+            per_test_results[test_name] = bool(result)
+        
+        try:
+            # Соединения в пуле клиента открываются заранее и переиспользуются тестами
+            await asyncio.to_thread(self._warmup)
+            
+            # Фаза 1: проверки компонентов выполняются одновременно
+            await asyncio.gather(*(run_test(*test) for test in independent_tests))
+            
+            # Фаза 2: зависимые проверки
+            for test_name, test_func in pipeline_tests:
+                await run_test(test_name, test_func)
+        finally:
+            await self._close_aio_session()
+            await self._close_ws()
         
-        # Подсчет результатов
-        total_tests = len(tests)
-        passed_tests = sum(1 for result in self.test_results.values() if result)
+        # Подсчет результатов по тестам, а не по детальным проверкам
+        total_tests = len(per_test_results)
+        passed_tests = sum(per_test_results.values())
         failed_tests = total_tests - passed_tests
         
         end_time = time.time()
@@ -325,17 +496,21 @@ class AvatarSystemTester:
             "failed_tests": failed_tests,
             "success_rate": (passed_tests/total_tests)*100,
             "duration": duration,
+            "tests": per_test_results,
             "results": self.test_results
         }
 
 def main():
     """Основная функция."""
     tester = AvatarSystemTester()
-    results = tester.run_all_tests()
+    try:
+        results = asyncio.run(tester.run_all_tests())
+    finally:
+        tester.close()
     
     # Сохранение результатов
-    with open("test_results.json", "w", encoding="utf-8") as f:
-        json.dump(results, f, ensure_ascii=False, indent=2)
+    with open("test_results.json", "wb") as f:
+        f.write(dumps(results, indent=True))
     
     logger.info(f"\n💾 Результаты сохранены в test_results.json")
     
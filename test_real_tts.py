@@ -3,10 +3,31 @@
 Тестовый скрипт для проверки реального синтеза речи
 """
 
-import requests
+import httpx
 import json
-import time
 import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from test_utils import make_client
+
+# Общий клиент для всех запросов к серверу синтеза
+client = make_client()
+
+# Сервер синтезирует фразы по очереди: больше параллельных запросов
+# только съедает их таймаут в ожидании
+MAX_CONCURRENT_SYNTH = 2
+
+def _synthesize(base_url: str, phrase: str) -> httpx.Response:
+    """Отправляет запрос на синтез одной фразы."""
+    return client.post(
+        f"{base_url}/synthesize",
+        json={
+            "text": phrase,
+            "language": "ru"
+        },
+        timeout=30
+    )
 
 def test_tts_synthesis():
     """Тестирует синтез речи через API"""
@@ -27,70 +48,81 @@ def test_tts_synthesis():
     print("=" * 50)
     
     results = []
+    # Текущий процесс воспроизведения: аудиоустройство используется по очереди
+    player = None
     
-    for i, phrase in enumerate(test_phrases, 1):
-        print(f"\n{i}. Синтезируем: '{phrase}'")
+    # Следующая фраза синтезируется, пока обрабатывается текущая;
+    # результаты обрабатываются по порядку
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_SYNTH) as executor:
+        futures = [executor.submit(_synthesize, base_url, phrase) for phrase in test_phrases]
         
-        try:
-            # Отправляем запрос на синтез
-            response = requests.post(
-                f"{base_url}/synthesize",
-                json={
-                    "text": phrase,
-                    "language": "ru"
-                },
-                timeout=30
-            )
+        for i, (phrase, future) in enumerate(zip(test_phrases, futures), 1):
+            print(f"\n{i}. Синтезируем: '{phrase}'")
             
-            if response.status_code == 200:
-                result = response.json()
-                print(f"   ✅ Успешно!")
-                print(f"   📁 Файл: {result['audio_path']}")
-                print(f"   ⏱️  Длительность: {result['duration']:.2f} сек")
-                print(f"   🔊 Частота: {result['sample_rate']} Hz")
+            try:
+                response = future.result()
                 
-                # Проверяем существование файла (исправляем путь)
-                file_path = f"HierSpeech_TTS/{result['audio_path']}"
-                if os.path.exists(file_path):
-                    file_size = os.path.getsize(file_path)
-                    print(f"   📊 Размер: {file_size} байт")
+                if response.status_code == 200:
+                    result = response.json()
+                    print(f"   ✅ Успешно!")
+                    print(f"   📁 Файл: {result['audio_path']}")
+                    print(f"   ⏱️  Длительность: {result['duration']:.2f} сек")
+                    print(f"   🔊 Частота: {result['sample_rate']} Hz")
                     
-                    # Воспроизводим аудио
-                    print(f"   🎵 Воспроизводим...")
-                    os.system(f"aplay {file_path}")
-                    
-                    results.append({
-                        "phrase": phrase,
-                        "success": True,
-                        "file": file_path,
-                        "duration": result['duration'],
-                        "size": file_size
-                    })
+                    # Проверяем существование файла (исправляем путь)
+                    file_path = f"HierSpeech_TTS/{result['audio_path']}"
+                    if os.path.exists(file_path):
+                        file_size = os.path.getsize(file_path)
+                        print(f"   📊 Размер: {file_size} байт")
+                        
+                        # Воспроизводим аудио
+                        print(f"   🎵 Воспроизводим...")
+                        if player is not None:
+                            player.wait()
+                            player = None
+                        try:
+                            player = subprocess.Popen(
+                                ["aplay", "-q", file_path],
+                                stdout=subprocess.DEVNULL,
+                                stderr=subprocess.DEVNULL
+                            )
+                        except OSError as e:
+                            # Отсутствие aplay не влияет на результат синтеза
+                            print(f"   ⚠️ Воспроизведение недоступно: {e}")
+                        
+                        results.append({
+                            "phrase": phrase,
+                            "success": True,
+                            "file": file_path,
+                            "duration": result['duration'],
+                            "size": file_size
+                        })
+                    else:
+                        print(f"   ❌ Файл не найден: {file_path}")
+                        results.append({
+                            "phrase": phrase,
+                            "success": False,
+                            "error": "Файл не создан"
+                        })
                 else:
-                    print(f"   ❌ Файл не найден: {file_path}")
+                    print(f"   ❌ Ошибка HTTP: {response.status_code}")
+                    print(f"   📄 Ответ: {response.text}")
                     results.append({
                         "phrase": phrase,
                         "success": False,
-                        "error": "Файл не создан"
+                        "error": f"HTTP {response.status_code}"
                     })
-            else:
-                print(f"   ❌ Ошибка HTTP: {response.status_code}")
-                print(f"   📄 Ответ: {response.text}")
+                    
+            except Exception as e:
+                print(f"   ❌ Ошибка: {e}")
                 results.append({
                     "phrase": phrase,
                     "success": False,
-                    "error": f"HTTP {response.status_code}"
+                    "error": str(e)
                 })
-                
-        except Exception as e:
-            print(f"   ❌ Ошибка: {e}")
-            results.append({
-                "phrase": phrase,
-                "success": False,
-                "error": str(e)
-            })
-        
-        time.sleep(1)  # Пауза между запросами
+    
+    if player is not None:
+        player.wait()
     
     # Итоговая статистика
     print("\n" + "=" * 50)
@@ -126,7 +158,7 @@ def test_health_check():
     print("-" * 30)
     
     try:
-        response = requests.get("http://127.0.0.1:8001/health")
+        response = client.get("http://127.0.0.1:8001/health")
         if response.status_code == 200:
             health = response.json()
             print(f"✅ Статус: {health['status']}")
@@ -147,6 +179,9 @@ if __name__ == "__main__":
     test_health_check()
     
     # Тестируем синтез речи
-    results = test_tts_synthesis()
+    try:
+        results = test_tts_synthesis()
+    finally:
+        client.close()
     
     print("\n🎉 Тестирование завершено!") 
\ No newline at end of file
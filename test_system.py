@@ -14,12 +14,34 @@
 """
 
 import asyncio
-import json
-import requests
+import re
+from concurrent.futures import ThreadPoolExecutor
+import httpx
 import time
 from datetime import datetime
 from typing import Dict, List, Any
 
+from test_utils import dumps, make_client
+
+# Объявление WebSocket endpoint в backend: декоратор и путь /ws/ рядом
+WEBSOCKET_ROUTE_PATTERN = re.compile(rb"@app\.websocket[\s\S]{0,4096}?/ws/")
+
+# Признак страницы frontend: "Цифровой" (UTF-8) или "digital" в любом регистре
+FRONTEND_MARKER_PATTERN = re.compile("Цифровой".encode('utf-8') + rb"|digital", re.IGNORECASE)
+
+
+def _stream_contains(response: httpx.Response, marker: bytes, chunk_size: int = 4096) -> bool:
+    """Поиск маркера в потоковом теле ответа с остановкой на первом совпадении."""
+    tail = b""
+    for chunk in response.iter_bytes(chunk_size):
+        # Хвост предыдущего блока: маркер может попасть на границу блоков
+        window = tail + chunk
+        if marker in window:
+            return True
+        # Для однобайтового маркера хвост не нужен (window[-0:] — весь блок)
+        tail = window[-(len(marker) - 1):] if len(marker) > 1 else b""
+    return False
+
 
 class SystemTester:
     """Класс для тестирования системы цифрового аватара."""
@@ -36,12 +58,18 @@ class SystemTester:
             "http://192.168.0.102:3002"
         ]
         self.results = {}
+        # Одна сессия на все проверки: соединения с backend переиспользуются
+        self.client = make_client()
+    
+    def close(self):
+        """Закрытие HTTP клиента."""
+        self.client.close()
         
     def test_backend_health(self) -> Dict[str, Any]:
         """Тест health endpoint backend."""
         print("🔍 Тестирование backend health endpoint...")
         try:
-            response = requests.get(f"{self.backend_url}/health", timeout=5)
+            response = self.client.get(f"{self.backend_url}/health", timeout=5)
             if response.status_code == 200:
                 data = response.json()
                 print(f"✅ Backend health: {data}")
@@ -57,8 +85,10 @@ class SystemTester:
         """Тест Swagger документации."""
         print("🔍 Тестирование Swagger документации...")
         try:
-            response = requests.get(f"{self.backend_url}/docs", timeout=5)
-            if response.status_code == 200 and "swagger-ui" in response.text:
+            # Читаем тело по частям и закрываем соединение, как только маркер найден
+            with self.client.stream("GET", f"{self.backend_url}/docs", timeout=5) as response:
+                found = response.status_code == 200 and _stream_contains(response, b"swagger-ui")
+            if found:
                 print("✅ Swagger документация доступна")
                 return {"status": "success"}
             else:
@@ -72,7 +102,7 @@ class SystemTester:
         """Тест OpenAPI схемы."""
         print("🔍 Тестирование OpenAPI схемы...")
         try:
-            response = requests.get(f"{self.backend_url}/openapi.json", timeout=5)
+            response = self.client.get(f"{self.backend_url}/openapi.json", timeout=5)
             if response.status_code == 200:
                 data = response.json()
                 endpoints = list(data.get("paths", {}).keys())
@@ -90,9 +120,9 @@ class SystemTester:
         print("🔍 Тестирование frontend...")
         for url in self.frontend_urls:
             try:
-                response = requests.get(url, timeout=5)
-                response.encoding = 'utf-8'
-                if response.status_code == 200 and ("Цифровой" in response.text or "digital" in response.text.lower()):
+                response = self.client.get(url, timeout=5)
+                # Поиск по байтам тела: без декодирования и копии в нижнем регистре
+                if response.status_code == 200 and FRONTEND_MARKER_PATTERN.search(response.content):
                     print(f"✅ Frontend доступен: {url}")
                     return {"status": "success", "url": url}
             except Exception as e:
@@ -106,7 +136,7 @@ class SystemTester:
         """Тест endpoint загрузки файлов."""
         print("🔍 Тестирование upload endpoint...")
         try:
-            response = requests.get(f"{self.backend_url}/api/v1/upload/status", timeout=5)
+            response = self.client.get(f"{self.backend_url}/api/v1/upload/status", timeout=5)
             if response.status_code == 200:
                 data = response.json()
                 print(f"✅ Upload endpoint доступен: {data.get('status')}")
@@ -127,10 +157,11 @@ class SystemTester:
             main_py_path = "./backend/app/main.py"
             
             if os.path.exists(main_py_path):
-                with open(main_py_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
+                # Поиск по байтам: без декодирования всего файла
+                with open(main_py_path, 'rb') as f:
+                    found = WEBSOCKET_ROUTE_PATTERN.search(f.read()) is not None
                 
-                if "@app.websocket" in content and "/ws/" in content:
+                if found:
                     print("✅ WebSocket endpoint найден в коде")
                     return {"status": "success", "message": "WebSocket endpoint реализован"}
                 else:
@@ -156,7 +187,9 @@ class SystemTester:
             results = {}
             
             if os.path.exists(models_path):
-                models_count = len([f for f in os.listdir(models_path) if os.path.isdir(os.path.join(models_path, f))])
+                # scandir отдает тип записи из readdir — без stat на каждую запись
+                with os.scandir(models_path) as entries:
+                    models_count = sum(1 for entry in entries if entry.is_dir(follow_symlinks=False))
                 print(f"✅ Папка models существует, подпапок: {models_count}")
                 results["models"] = {"status": "success", "count": models_count}
             else:
@@ -164,7 +197,8 @@ class SystemTester:
                 results["models"] = {"status": "error", "message": "Папка не существует"}
             
             if os.path.exists(cache_path):
-                cache_size = len(os.listdir(cache_path))
+                with os.scandir(cache_path) as entries:
+                    cache_size = sum(1 for _ in entries)
                 print(f"✅ Папка cache существует, файлов: {cache_size}")
                 results["cache"] = {"status": "success", "size": cache_size}
             else:
@@ -184,18 +218,23 @@ class SystemTester:
         
         start_time = time.time()
         
-        # Запуск тестов
-        self.results = {
-            "timestamp": datetime.now().isoformat(),
-            "backend_health": self.test_backend_health(),
-            "backend_docs": self.test_backend_docs(),
-            "backend_openapi": self.test_backend_openapi(),
-            "frontend": self.test_frontend(),
-            "upload_endpoint": self.test_upload_endpoint(),
-            "websocket_endpoint": self.test_websocket_endpoint(),
-            "ai_models": self.test_ai_models_availability()
+        tests = {
+            "backend_health": self.test_backend_health,
+            "backend_docs": self.test_backend_docs,
+            "backend_openapi": self.test_backend_openapi,
+            "frontend": self.test_frontend,
+            "upload_endpoint": self.test_upload_endpoint,
+            "websocket_endpoint": self.test_websocket_endpoint,
+            "ai_models": self.test_ai_models_availability
         }
         
+        # Тесты независимы — запускаем одновременно, порядок результатов сохраняется
+        self.results = {"timestamp": datetime.now().isoformat()}
+        with ThreadPoolExecutor(max_workers=len(tests)) as executor:
+            futures = {name: executor.submit(test_func) for name, test_func in tests.items()}
+            for name, future in futures.items():
+                self.results[name] = future.result()
+        
         end_time = time.time()
         self.results["execution_time"] = end_time - start_time
         
@@ -233,8 +272,8 @@ class SystemTester:
                 print(f"{status} {test_name}: {result.get('status', 'unknown')}")
         
         # Сохранение результатов
-        with open("system_test_results.json", "w", encoding="utf-8") as f:
-            json.dump(self.results, f, ensure_ascii=False, indent=2)
+        with open("system_test_results.json", "wb") as f:
+            f.write(dumps(self.results, indent=True))
         
         print(f"\n💾 Результаты сохранены в system_test_results.json")
 
@@ -242,7 +281,10 @@ class SystemTester:
 def main():
     """Основная функция."""
     tester = SystemTester()
-    results = tester.run_all_tests()
+    try:
+        results = tester.run_all_tests()
+    finally:
+        tester.close()
     tester.print_summary()
     
     # Возвращаем код выхода
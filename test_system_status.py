@@ -12,148 +12,299 @@
 Версия: 1.0.0
 """
 
-import requests
-import subprocess
+import argparse
+import asyncio
+import io
+import os
+import httpx
 import json
-import time
+import sys
 from datetime import datetime
+from typing import Dict, Set, TextIO
 
-def check_backend():
-    """Проверка backend API."""
-    print("🔍 Проверка Backend API...")
+from test_utils import loads
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Backend API и TTS работают на одном порту
+BACKEND_PORT = 8001
+BACKEND_URL = f"http://127.0.0.1:{BACKEND_PORT}"
+
+# Таймауты: локальный порт либо отвечает сразу, либо закрыт
+API_TIMEOUT = httpx.Timeout(2.0, connect=0.2)
+FRONTEND_TIMEOUT = httpx.Timeout(1.0, connect=0.2)
+
+# Порты, на которых может работать frontend
+FRONTEND_PORTS = [3000, 3001, 3002, 3003]
+
+# Все порты, которые проверяет check_ports (множество — проверка вхождения за O(1))
+WATCHED_PORTS = frozenset([BACKEND_PORT, *FRONTEND_PORTS])
+
+async def _port_open(host: str, port: int, timeout: float = 0.2) -> bool:
+    """Быстрая проверка, принимает ли порт TCP соединения."""
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return False
+    writer.close()
+    return True
+
+async def check_backend(client: httpx.AsyncClient, out: TextIO = sys.stdout, details: bool = False):
+    """Проверка backend API (details=False — только доступность, без разбора JSON)."""
+    print("🔍 Проверка Backend API...", file=out)
+    
+    # Закрытый порт не проверяем по HTTP
+    if not await _port_open("127.0.0.1", BACKEND_PORT):
+        print(f"❌ Backend недоступен: порт {BACKEND_PORT} закрыт", file=out)
+        return False
     
     try:
         # Проверка health endpoint
-        response = requests.get("http://127.0.0.1:8001/health", timeout=5)
+        response = await client.get("/health")
         if response.status_code == 200:
-            data = response.json()
-            print(f"✅ Backend работает: {data['status']} (версия {data['version']})")
+            if not details:
+                print("✅ Backend работает", file=out)
+                return True
+            data = loads(response.content)
+            print(f"✅ Backend работает: {data['status']} (версия {data['version']})", file=out)
             return True
         else:
-            print(f"❌ Backend недоступен: статус {response.status_code}")
+            print(f"❌ Backend недоступен: статус {response.status_code}", file=out)
             return False
     except Exception as e:
-        print(f"❌ Ошибка подключения к backend: {e}")
+        print(f"❌ Ошибка подключения к backend: {e}", file=out)
         return False
 
-def check_tts_service():
+async def check_tts_service(client: httpx.AsyncClient, out: TextIO = sys.stdout):
     """Проверка TTS сервиса."""
-    print("\n🔍 Проверка TTS сервиса...")
+    print("\n🔍 Проверка TTS сервиса...", file=out)
+    
+    if not await _port_open("127.0.0.1", BACKEND_PORT):
+        print(f"❌ TTS сервис недоступен: порт {BACKEND_PORT} закрыт", file=out)
+        return False
     
     try:
-        response = requests.get("http://127.0.0.1:8001/api/v1/tts/status", timeout=5)
+        response = await client.get("/api/v1/tts/status")
         if response.status_code == 200:
-            data = response.json()
-            print(f"✅ TTS сервис: {data['service']}")
-            print(f"   - Доступен: {'✅' if data['available'] else '❌'}")
-            print(f"   - Поддерживает русский: {'✅' if data['supports_russian'] else '❌'}")
-            print(f"   - Клонирование голоса: {'✅' if data['voice_cloning'] else '❌'}")
+            data = loads(response.content)
+            print(f"✅ TTS сервис: {data['service']}", file=out)
+            print(f"   - Доступен: {'✅' if data['available'] else '❌'}", file=out)
+            print(f"   - Поддерживает русский: {'✅' if data['supports_russian'] else '❌'}", file=out)
+            print(f"   - Клонирование голоса: {'✅' if data['voice_cloning'] else '❌'}", file=out)
             return data['available']
         else:
-            print(f"❌ TTS сервис недоступен: статус {response.status_code}")
+            print(f"❌ TTS сервис недоступен: статус {response.status_code}", file=out)
             return False
     except Exception as e:
-        print(f"❌ Ошибка подключения к TTS: {e}")
+        print(f"❌ Ошибка подключения к TTS: {e}", file=out)
         return False
 
-def check_frontend():
+async def check_frontend(client: httpx.AsyncClient, out: TextIO = sys.stdout):
     """Проверка frontend."""
-    print("\n🔍 Проверка Frontend...")
+    print("\n🔍 Проверка Frontend...", file=out)
     
-    # Проверяем разные порты
-    ports = [3000, 3001, 3002, 3003]
+    async def probe(port):
+        # HTTP запрос только если порт принимает соединения
+        # (localhost: dev сервер может слушать только IPv6)
+        if not await _port_open("localhost", port):
+            return False
+        try:
+            response = await client.get(f"http://localhost:{port}", timeout=FRONTEND_TIMEOUT)
+            return response.status_code == 200
+        except Exception:
+            return False
     
-    for port in ports:
+    # Опрашиваем все порты одновременно и останавливаемся на первом ответившем
+    tasks = {asyncio.create_task(probe(port)): port for port in FRONTEND_PORTS}
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.result():
+                    print(f"✅ Frontend работает на порту {tasks[task]}", file=out)
+                    return True
+    finally:
+        for task in pending:
+            task.cancel()
+    
+    print("❌ Frontend недоступен на всех портах", file=out)
+    return False
+
+def _listening_ports(wanted: Set[int]) -> Dict[int, int]:
+    """Прослушиваемые TCP порты из wanted по /proc/net/tcp{,6}: порт -> inode сокета."""
+    listening = {}
+    for path in ("/proc/net/tcp", "/proc/net/tcp6"):
         try:
-            response = requests.get(f"http://localhost:{port}", timeout=3)
-            if response.status_code == 200:
-                print(f"✅ Frontend работает на порту {port}")
-                return True
-        except:
+            with open(path) as f:
+                next(f)  # Заголовок
+                for line in f:
+                    fields = line.split()
+                    # Состояние 0A — LISTEN
+                    if fields[3] == "0A":
+                        port = int(fields[1].rsplit(":", 1)[1], 16)
+                        if port in wanted:
+                            listening[port] = int(fields[9])
+        except OSError:
             continue
+    return listening
+
+def _socket_owners(inodes: Set[int]) -> Dict[int, str]:
+    """Имена процессов, владеющих сокетами: inode -> comm."""
+    owners = {}
+    targets = {f"socket:[{inode}]": inode for inode in inodes}
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit():
+            continue
+        fd_dir = f"/proc/{pid}/fd"
+        try:
+            links = [os.readlink(f"{fd_dir}/{fd}") for fd in os.listdir(fd_dir)]
+        except OSError:
+            continue  # Процесс завершился или нет прав
+        found = [targets[link] for link in links if link in targets]
+        if found:
+            try:
+                with open(f"/proc/{pid}/comm") as f:
+                    name = f.read().strip()
+            except OSError:
+                continue
+            for inode in found:
+                owners[inode] = name
+            if len(owners) == len(targets):
+                break
+    return owners
+
+def _port_owners(ports: Set[int]) -> Dict[int, str]:
+    """Имена процессов, слушающих указанные порты: порт -> имя процесса."""
+    if psutil is not None:
+        try:
+            listen_by_port = {
+                conn.laddr.port: conn.pid
+                for conn in psutil.net_connections(kind="tcp")
+                if conn.status == psutil.CONN_LISTEN and conn.laddr.port in ports
+            }
+            owners = {}
+            for port, pid in listen_by_port.items():
+                try:
+                    owners[port] = psutil.Process(pid).name() if pid else ""
+                except (psutil.NoSuchProcess, psutil.AccessDenied):
+                    owners[port] = ""
+            return owners
+        except psutil.AccessDenied:
+            pass  # Нет прав на список соединений — читаем /proc
     
-    print("❌ Frontend недоступен на всех портах")
-    return False
+    listening = _listening_ports(ports)
+    inode_owners = _socket_owners(set(listening.values()))
+    return {port: inode_owners.get(inode, "") for port, inode in listening.items()}
 
-def check_ports():
+def check_ports(out: TextIO = sys.stdout):
     """Проверка занятых портов."""
-    print("\n🔍 Проверка портов...")
+    print("\n🔍 Проверка портов...", file=out)
     
     try:
-        result = subprocess.run(
-            ["netstat", "-tlnp"], 
-            capture_output=True, 
-            text=True, 
-            timeout=5
-        )
+        # Ищем наши сервисы
+        owners = _port_owners(WATCHED_PORTS)
         
-        if result.returncode == 0:
-            lines = result.stdout.split('\n')
-            
-            # Ищем наши сервисы
-            backend_found = False
-            frontend_found = False
-            
-            for line in lines:
-                if ':8001' in line and 'python' in line:
-                    print("✅ Backend порт 8001 активен")
-                    backend_found = True
-                elif any(f':{port}' in line and 'node' in line for port in ['3000', '3001', '3002', '3003']):
-                    if not frontend_found:
-                        print("✅ Frontend порт активен")
-                        frontend_found = True
-            
-            if not backend_found:
-                print("❌ Backend порт 8001 не найден")
-            if not frontend_found:
-                print("❌ Frontend порты не найдены")
-                
-            return backend_found and frontend_found
+        backend_found = "python" in owners.get(BACKEND_PORT, "")
+        frontend_found = any("node" in owners.get(port, "") for port in FRONTEND_PORTS)
+        
+        if backend_found:
+            print("✅ Backend порт 8001 активен", file=out)
         else:
-            print("❌ Не удалось проверить порты")
-            return False
+            print("❌ Backend порт 8001 не найден", file=out)
+        if frontend_found:
+            print("✅ Frontend порт активен", file=out)
+        else:
+            print("❌ Frontend порты не найдены", file=out)
+        
+        return backend_found and frontend_found
             
     except Exception as e:
-        print(f"❌ Ошибка проверки портов: {e}")
+        print(f"❌ Ошибка проверки портов: {e}", file=out)
         return False
 
+async def _run_checks(buffers: Dict[str, TextIO], details: bool = True) -> Dict[str, bool]:
+    """Одновременный запуск всех проверок с общим HTTP клиентом."""
+    # Все сервисы локальные: переменные окружения с прокси не нужны
+    async with httpx.AsyncClient(base_url=BACKEND_URL, timeout=API_TIMEOUT, trust_env=False) as client:
+        backend_ok, tts_ok, frontend_ok = await asyncio.gather(
+            check_backend(client, buffers["backend"], details=details),
+            check_tts_service(client, buffers["tts"]),
+            check_frontend(client, buffers["frontend"])
+        )
+    
+    # Проверка портов нужна только для диагностики, если HTTP проверки не прошли
+    if backend_ok and frontend_ok:
+        print("\n🔍 Проверка портов...", file=buffers["ports"])
+        print("✅ Backend и frontend отвечают по HTTP — проверка портов пропущена", file=buffers["ports"])
+        ports_ok = True
+    else:
+        # Проверка портов читает /proc — выполняется в потоке
+        ports_ok = await asyncio.to_thread(check_ports, buffers["ports"])
+    return {"backend": backend_ok, "tts": tts_ok, "frontend": frontend_ok, "ports": ports_ok}
+
 def main():
     """Основная функция проверки."""
-    print("🚀 Проверка системы цифрового аватара")
-    print("=" * 50)
-    print(f"Время проверки: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-    print()
+    parser = argparse.ArgumentParser(description="Проверка статуса системы цифрового аватара")
+    parser.add_argument("--json", action="store_true", help="Вывести результат в JSON (для скриптов)")
+    args = parser.parse_args()
     
-    # Проверки
-    backend_ok = check_backend()
-    tts_ok = check_tts_service()
-    frontend_ok = check_frontend()
-    ports_ok = check_ports()
+    # Проверки независимы — выполняем одновременно, вывод каждой собираем отдельно
+    names = ("backend", "tts", "frontend", "ports")
+    buffers = {name: io.StringIO() for name in names}
+    # В режиме --json нужна только доступность: ответ backend не разбираем
+    results = asyncio.run(_run_checks(buffers, details=not args.json))
+    
+    if args.json:
+        sys.stdout.write(json.dumps({name: bool(ok) for name, ok in results.items()}) + "\n")
+        return
+    
+    backend_ok = results["backend"]
+    tts_ok = results["tts"]
+    frontend_ok = results["frontend"]
+    ports_ok = results["ports"]
+    
+    out = [
+        "🚀 Проверка системы цифрового аватара",
+        "=" * 50,
+        f"Время проверки: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+        ""
+    ]
+    
+    # Вывод проверок в фиксированном порядке, независимо от порядка завершения
+    out.append("".join(buffers[name].getvalue() for name in names).rstrip("\n"))
     
     # Итоговый результат
-    print("\n" + "=" * 50)
-    print("📊 ИТОГОВЫЙ СТАТУС:")
-    print(f"Backend API: {'✅ Работает' if backend_ok else '❌ Не работает'}")
-    print(f"TTS сервис: {'✅ Доступен' if tts_ok else '❌ Недоступен'}")
-    print(f"Frontend: {'✅ Работает' if frontend_ok else '❌ Не работает'}")
-    print(f"Порты: {'✅ Активны' if ports_ok else '❌ Проблемы'}")
+    out.append("\n" + "=" * 50)
+    out.append("📊 ИТОГОВЫЙ СТАТУС:")
+    out.append(f"Backend API: {'✅ Работает' if backend_ok else '❌ Не работает'}")
+    out.append(f"TTS сервис: {'✅ Доступен' if tts_ok else '❌ Недоступен'}")
+    out.append(f"Frontend: {'✅ Работает' if frontend_ok else '❌ Не работает'}")
+    out.append(f"Порты: {'✅ Активны' if ports_ok else '❌ Проблемы'}")
     
     # Рекомендации
-    print("\n💡 РЕКОМЕНДАЦИИ:")
+    out.append("\n💡 РЕКОМЕНДАЦИИ:")
     
     if not backend_ok:
-        print("- Запустите backend: source ai_env/bin/activate && python -m uvicorn backend.app.main:app --reload --host 127.0.0.1 --port 8001")
+        out.append("- Запустите backend: source ai_env/bin/activate && python -m uvicorn backend.app.main:app --reload --host 127.0.0.1 --port 8001")
     
     if not frontend_ok:
-        print("- Запустите frontend: cd frontend && npm run dev")
+        out.append("- Запустите frontend: cd frontend && npm run dev")
     
     if not tts_ok:
-        print("- Установите API ключ ElevenLabs для полной функциональности TTS")
+        out.append("- Установите API ключ ElevenLabs для полной функциональности TTS")
     
     if backend_ok and frontend_ok:
-        print("🎉 Система готова к работе!")
-        print("📱 Откройте браузер: http://localhost:3003")
-        print("📚 API документация: http://127.0.0.1:8001/docs")
+        out.append("🎉 Система готова к работе!")
+        out.append("📱 Откройте браузер: http://localhost:3003")
+        out.append("📚 API документация: http://127.0.0.1:8001/docs")
+    
+    # Один вызов write вместо множества print
+    sys.stdout.write("\n".join(out) + "\n")
+    sys.stdout.flush()
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
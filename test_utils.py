@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Общие вспомогательные функции тестовых скриптов системы цифрового аватара.
+
+- Сериализация JSON (orjson, если установлен)
+- HTTP клиент httpx с пулом keep-alive соединений
+"""
+
+import json
+from typing import Any
+
+try:
+    import orjson
+    loads = orjson.loads
+except ImportError:
+    orjson = None
+    loads = json.loads
+
+try:
+    # HTTP/2 в httpx требует пакет h2
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+def dumps(obj: Any, indent: bool = False) -> bytes:
+    """Сериализация в JSON (orjson, если установлен)."""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(obj, option=option)
+    return json.dumps(obj, ensure_ascii=False, indent=2 if indent else None).encode('utf-8')
+
+
+def make_client():
+    """HTTP клиент с пулом keep-alive соединений (HTTP/2, если установлен h2)."""
+    # httpx импортируется здесь: скриптам на aiohttp он не нужен
+    import httpx
+
+    return httpx.Client(
+        timeout=10.0,
+        # Как в requests: редиректы выполняются автоматически
+        follow_redirects=True,
+        # retries — повторы только при ошибках установки соединения
+        transport=httpx.HTTPTransport(
+            http2=HTTP2_AVAILABLE,
+            limits=httpx.Limits(max_keepalive_connections=16, max_connections=32),
+            retries=2
+        )
+    )